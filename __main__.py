@@ -1,13 +1,52 @@
-from phylogeny import remap_tree_labels
-from pathlib import Path
-if __name__ == "__main__":
-	projects_folder = Path.home() / "Documents" / "projects" / "docusate"
-	treename = Path.home() / "Documents" / "projects" / "docusate" / "iqtree_final_output_quick" / "nasp_full_quickbb.treefile"
-	folder = projects_folder / "genome_assemblies" / "outgroups"
+"""
+	The command-line interface of the cooperlab tools: `python -m cooperlab <command> [options]`.
+
+	Each command is implemented by the `main()` function of its module, which is only imported when that command is
+	run so that light commands (ex. dmux-concat, relabel-tree) do not pay for pandas/Bio imports.
+"""
+from typing import List
+import importlib
+import sys
+
+# command -> (module, description)
+COMMANDS = {
+	'breseq':       ('breseq.breseq_parser', "Parse a folder of breseq output folders into snp/coverage/junction tables."),
+	'isolate':      ('breseq.isolate_parser', "Generate the annotated mutation table of a single breseq output folder."),
+	'isolate-set':  ('breseq.isolate_set_parser', "Combine the mutation tables of a folder of breseq output folders."),
+	'ncbi-report':  ('misc_parsers.ncbi_report', "Read NCBI assembly reports or verify/unpack NCBI genome packages."),
+	'ncbi-catalog': ('misc_parsers.ncbi_catalog', "Build, update and query a catalog of NCBI assembly reports."),
+	'relabel-tree': ('phylogeny.tree_labels', "Replace assembly accessions in newick trees with organism names."),
+	'dmux-concat':  ('scripts.dmux_concat', "Concatenate demultiplexed fastq files based on a sample sheet."),
+	'benchmark':    ('benchmarks.suite', "Time the parsers on synthetic data and check for regressions against saved baselines.")
+}
+
 
-	folder2 = projects_folder / "genome_assemblies" / "ncbi-genomes"
-	pattern = "*/*_assembly_report.txt"
-	reports = list(folder.glob(pattern)) + list(folder2.glob(pattern))
+def usage() -> str:
+	lines = ["usage: python -m cooperlab <command> [options]", "", "commands:"]
+	lines += ["  {:<14}{}".format(command, description) for command, (_, description) in COMMANDS.items()]
+	lines += ["", "Run 'python -m cooperlab <command> --help' for the options of a command."]
+	return "\n".join(lines)
 
 
-	remap_tree_labels(treename, reports)
\ No newline at end of file
+def main(argv: List[str] = None):
+	argv = sys.argv[1:] if argv is None else argv
+	if not argv or argv[0] in ('-h', '--help'):
+		print(usage())
+		return
+	command, *arguments = argv
+	if command not in COMMANDS:
+		print("Unknown command '{}'\n".format(command))
+		print(usage())
+		sys.exit(2)
+
+	module_name, _ = COMMANDS[command]
+	if __package__:
+		module = importlib.import_module('.' + module_name, __package__)
+	else:
+		module = importlib.import_module(module_name)
+	sys.argv[0] = "cooperlab {}".format(command)
+	module.main(arguments)
+
+
+if __name__ == "__main__":
+	main()
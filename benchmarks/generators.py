@@ -0,0 +1,201 @@
+"""
+	Deterministic generators of synthetic input data for the benchmark suite. Every generator takes a seed, so the same
+	arguments always produce the same files.
+"""
+from pathlib import Path
+from typing import Dict, List
+import gzip
+import random
+
+BASES = 'ACGT'
+MUTATION_TYPES = ['SNP', 'SNP', 'SNP', 'INS', 'DEL', 'SUB', 'MOB', 'AMP']
+
+
+def random_sequence(rng: random.Random, length: int) -> str:
+	return "".join(rng.choice(BASES) for _ in range(length))
+
+
+def write_reference(path: Path, contigs: Dict[str, int], seed: int = 0) -> Path:
+	""" Writes a fasta file with the given contig names and lengths."""
+	rng = random.Random(seed)
+	with path.open('w') as fasta:
+		for name, length in contigs.items():
+			fasta.write(">{}\n".format(name))
+			sequence = random_sequence(rng, length)
+			for start in range(0, length, 80):
+				fasta.write(sequence[start:start + 80] + "\n")
+	return path
+
+
+def write_genome_diff(path: Path, mutations: int, contigs: Dict[str, int], seed: int = 0, polymorphic: bool = False) -> Path:
+	""" Writes a .gd file with a mix of mutation types, each supported by RA, MC or JC evidence."""
+	rng = random.Random(seed)
+	names = list(contigs.keys())
+	mutation_lines = list()
+	evidence_lines = list()
+	evidence_id = mutations + 1
+	for index in range(1, mutations + 1):
+		seq_id = rng.choice(names)
+		position = rng.randint(10, contigs[seq_id] - 200)
+		mutation_type = rng.choice(MUTATION_TYPES)
+		frequency = round(rng.uniform(0.05, 1), 3) if polymorphic else 1
+		named = "frequency={}\tgene_name=gene{}\tgene_position=coding ({} nt)\tmutation_category=snp_nonsynonymous".format(
+			frequency, rng.randint(1, 5000), rng.randint(1, 1500))
+		if mutation_type == 'SNP':
+			fields = [seq_id, position, rng.choice(BASES)]
+			evidence_lines.append("RA\t{}\t.\t{}\t{}\t0\t{}\t{}".format(evidence_id, seq_id, position, rng.choice(BASES), rng.choice(BASES)))
+		elif mutation_type == 'INS':
+			fields = [seq_id, position, random_sequence(rng, rng.randint(1, 5))]
+			evidence_lines.append("RA\t{}\t.\t{}\t{}\t1\t.\t{}".format(evidence_id, seq_id, position, rng.choice(BASES)))
+		elif mutation_type in ('DEL', 'AMP'):
+			size = rng.randint(1, 150)
+			fields = [seq_id, position, size] + ([2] if mutation_type == 'AMP' else [])
+			evidence_lines.append("MC\t{}\t.\t{}\t{}\t{}\t0\t0".format(evidence_id, seq_id, position, position + size - 1))
+		elif mutation_type == 'SUB':
+			size = rng.randint(2, 6)
+			fields = [seq_id, position, size, random_sequence(rng, rng.randint(1, 6))]
+			evidence_lines.append("RA\t{}\t.\t{}\t{}\t0\t{}\t{}".format(evidence_id, seq_id, position, rng.choice(BASES), rng.choice(BASES)))
+		else:
+			fields = [seq_id, position, "IS{}".format(rng.randint(1, 10)), rng.choice([-1, 1]), rng.randint(3, 9)]
+			evidence_lines.append("JC\t{0}\t.\t{1}\t{2}\t1\t{1}\t{3}\t-1\t0".format(evidence_id, seq_id, position, position + 1000))
+		mutation_lines.append("\t".join(map(str, [mutation_type, index, evidence_id] + fields)) + "\t" + named)
+		evidence_id += 1
+
+	with path.open('w') as gd_file:
+		gd_file.write("#=GENOME_DIFF\t1.0\n")
+		gd_file.write("\n".join(mutation_lines + evidence_lines) + "\n")
+	return path
+
+
+def write_breseq_index(path: Path, mutations: int, coverage: int, junctions: int, seed: int = 0, polymorphic: bool = False) -> Path:
+	""" Writes an index.html file with the predicted mutation, missing coverage and new junction tables generated by breseq."""
+	rng = random.Random(seed)
+	row_class = 'polymorphism_table_row' if polymorphic else 'normal_table_row'
+	lines = ["<html><body>", "<table border=\"0\" cellspacing=\"1\" cellpadding=\"3\">"]
+	headers = ['evidence', 'seq id', 'position', 'mutation'] + (['freq'] if polymorphic else []) + ['annotation', 'gene', 'description']
+	lines.append("<tr>" + "".join("<th>{}</th>".format(i) for i in headers) + "</tr>")
+	lines.append("<!-- Item Lines -->")
+	for _ in range(mutations):
+		values = ['RA', 'NC_000913', "{:,}".format(rng.randint(1, 4600000)), "{}&rarr;{}".format(rng.choice(BASES), rng.choice(BASES))]
+		if polymorphic:
+			values.append("{:.1f}%".format(rng.uniform(5, 100)))
+		values += ["A{}V (GCG&rarr;GTG)".format(rng.randint(1, 500)), "gene{}&nbsp;&rarr;".format(rng.randint(1, 5000)), "hypothetical protein"]
+		lines.append("<tr class=\"{}\">".format(row_class) + "".join("<td>{}</td>".format(i) for i in values) + "</tr>")
+	lines.append("</table>")
+
+	lines.append("<table>")
+	lines.append('<tr><th align="left" class="missing_coverage_header_row" colspan="11">Unassigned missing coverage evidence</th></tr>')
+	coverage_headers = ['&nbsp;', '&nbsp;', 'seq id', 'start', 'end', 'size', '&larr;cov', 'cov&rarr;', 'gene', '&nbsp;', 'description']
+	lines.append("<tr>" + "".join("<th>{}</th>".format(i) for i in coverage_headers) + "</tr>")
+	for _ in range(coverage):
+		start = rng.randint(1, 4600000)
+		size = rng.randint(100, 20000)
+		values = ['*', '?', 'NC_000913', "{:,}".format(start), "{:,}".format(start + size), "{:,}".format(size), '0', '0', 'gene', '', 'deleted region']
+		lines.append("<tr>" + "".join("<td>{}</td>".format(i) for i in values) + "</tr>")
+	lines.append("</table>")
+
+	lines.append("<table>")
+	lines.append('<tr><th align="left" class="new_junction_header_row" colspan="12">Unassigned new junction evidence</th></tr>')
+	junction_headers = ['&nbsp;', 'seq id', 'position', 'reads (cov)', 'reads (cov)', 'score', 'skew', 'freq', 'annotation', 'gene', 'product']
+	lines.append("<tr>" + "".join("<th>{}</th>".format(i) for i in junction_headers) + "</tr>")
+	for _ in range(junctions):
+		side_a = ['*', '?', 'NC_000913', "{:,} =".format(rng.randint(1, 4600000)), '10 (0.5)', '12/200', '0.1', '0.2', '50%', 'intergenic', 'geneA', 'protein A']
+		side_b = ['?', 'NC_000913', "= {:,}".format(rng.randint(1, 4600000)), '9 (0.4)', 'intergenic', 'geneB', 'protein B']
+		lines.append("<tr class=\"mutation_table_row_0\">" + "".join("<td>{}</td>".format(i) for i in side_a) + "</tr>")
+		lines.append("<tr class=\"mutation_table_row_0\">" + "".join("<td>{}</td>".format(i) for i in side_b) + "</tr>")
+	lines.append("</table></body></html>")
+
+	with path.open('w') as index_file:
+		index_file.write("\n".join(lines))
+	return path
+
+
+def write_breseq_folder(folder: Path, mutations: int, contigs: Dict[str, int], seed: int = 0) -> Path:
+	""" Writes a breseq output folder with the files read by `Isolate`."""
+	(folder / "output" / "evidence").mkdir(parents = True, exist_ok = True)
+	(folder / "data").mkdir(parents = True, exist_ok = True)
+	write_reference(folder / "data" / "reference.fasta", contigs, seed)
+	write_genome_diff(folder / "output" / "output.gd", mutations, contigs, seed)
+	write_genome_diff(folder / "output" / "evidence" / "evidence.gd", mutations, contigs, seed)
+	write_genome_diff(folder / "output" / "evidence" / "annotated.gd", mutations, contigs, seed)
+	write_breseq_index(folder / "output" / "index.html", mutations, max(1, mutations // 10), max(1, mutations // 10), seed)
+	return folder
+
+
+def write_assembly_report(folder: Path, index: int, sequences: int, seed: int = 0) -> Path:
+	""" Writes an NCBI genome package folder containing an assembly report."""
+	rng = random.Random(seed * 1000003 + index)
+	accession = "GCF_{:09d}.1".format(index)
+	assembly_name = "ASM{}v1".format(index)
+	package = folder / "{}_{}".format(accession, assembly_name)
+	package.mkdir(parents = True, exist_ok = True)
+	lines = [
+		"# Assembly name:  {}".format(assembly_name),
+		"# Organism name:  Burkholderia sp. HI{} (b-proteobacteria)".format(index),
+		"# Infraspecific name:  strain=HI{}".format(index),
+		"# Taxid:          {}".format(rng.randint(1, 3000000)),
+		"# BioSample:      SAMN{:08d}".format(index),
+		"# BioProject:     PRJNA{:06d}".format(index),
+		"# Submitter:      University of Michigan",
+		"# Date:           2017-7-{}".format(rng.randint(1, 28)),
+		"# Assembly type:  n/a",
+		"# Release type:   major",
+		"# Assembly level: {}".format(rng.choice(['Contig', 'Scaffold', 'Complete Genome'])),
+		"# Genome representation: full",
+		"# Assembly method: SPAdes v. 3.7.0",
+		"# Genome coverage: 150x",
+		"# Sequencing technology: Illumina HiSeq",
+		"# GenBank assembly accession: GCA_{:09d}.1".format(index),
+		"# RefSeq assembly accession: {}".format(accession),
+		"# RefSeq assembly and GenBank assemblies identical: yes",
+		"#",
+		"# Sequence-Name\tSequence-Role\tAssigned-Molecule\tAssigned-Molecule-Location/Type\tGenBank-Accn\tRelationship\tRefSeq-Accn\tAssembly-Unit\tSequence-Length\tUCSC-style-name"
+	]
+	for contig in range(sequences):
+		role, molecule = ('assembled-molecule', 'Chromosome') if contig == 0 else ('unplaced-scaffold', 'na')
+		lines.append("contig{0}\t{1}\tna\t{2}\tNKFO{3:06d}{0}.1\t=\tNZ_NKFO{3:06d}{0}.1\tPrimary Assembly\t{4}\tna".format(
+			contig, role, molecule, index, rng.randint(500, 500000)))
+	path = package / "{}_{}_assembly_report.txt".format(accession, assembly_name)
+	path.write_text("\n".join(lines) + "\n")
+	return path
+
+
+def write_newick(path: Path, labels: List[str], seed: int = 0) -> Path:
+	""" Writes a random bifurcating tree with support values and branch lengths."""
+	rng = random.Random(seed)
+	nodes = ["{}:{:.5f}".format(label, rng.random()) for label in labels]
+	while len(nodes) > 1:
+		index = rng.randrange(len(nodes) - 1)
+		nodes[index:index + 2] = ["({},{}){}:{:.5f}".format(nodes[index], nodes[index + 1], rng.randint(0, 100), rng.random())]
+	path.write_text(nodes[0] + ";\n")
+	return path
+
+
+def write_fastq_lanes(dmux_folder: Path, run: str, samples: int, reads: int, lanes: int = 4, seed: int = 0) -> Path:
+	"""
+		Writes gzipped fastq files in the layout read by dmux_concat (`<dmux>/<run>/<project>/<folder>/*.fastq.gz`)
+		and a matching sample sheet. Returns the sample sheet.
+	"""
+	rng = random.Random(seed)
+	fastq_folder = dmux_folder / run / "project" / "fastq"
+	fastq_folder.mkdir(parents = True, exist_ok = True)
+	names = ["sample{}".format(i) for i in range(samples)]
+	# Reads are drawn from a pool of sequences so that large lane sets can be generated quickly.
+	pool = [random_sequence(rng, 75) for _ in range(4096)]
+	quality = 'I' * 75
+	for number, name in enumerate(names, start = 1):
+		for lane in range(1, lanes + 1):
+			for read in (1, 2):
+				records = list()
+				for index in range(reads):
+					sequence = pool[rng.randrange(len(pool))]
+					records.append("@{}:{}:{}\n{}\n+\n{}\n".format(name, lane, index, sequence, quality))
+				path = fastq_folder / "{}_S{}_L{:03d}_R{}_001.fastq.gz".format(name, number, lane, read)
+				path.write_bytes(gzip.compress("".join(records).encode(), compresslevel = 1))
+
+	sample_sheet = dmux_folder.parent / "data" / run / "SampleSheet.csv"
+	sample_sheet.parent.mkdir(parents = True, exist_ok = True)
+	lines = ["[Header]"] + ["IEMFileVersion,4"] * 7 + ["[Data]", "Sample_ID,Sample_Name,Sample_Well"]
+	lines += ["{0},{1},A{0}".format(number, name) for number, name in enumerate(names, start = 1)]
+	sample_sheet.write_text("\n".join(lines) + "\n")
+	return sample_sheet
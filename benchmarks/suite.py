@@ -0,0 +1,363 @@
+"""
+	Times the main parsers on synthetic data and compares the results against saved baselines.
+
+	Each benchmark generates its input once, then runs `repeat` times for the wall time (the best run is kept) and once
+	more under tracemalloc for the peak memory, so the memory tracing does not slow the timed runs.
+"""
+from pathlib import Path
+from typing import Callable, Dict, List
+from contextlib import redirect_stdout
+from dataclasses import dataclass, asdict
+import argparse
+import importlib
+import io
+import json
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+	from . import generators
+except:
+	import generators
+
+# The size of the generated data for each benchmark.
+SIZES = {
+	'small': {
+		'samples': 4, 'mutations': 200, 'contig_length': 50000,
+		'reports': 50, 'sequences': 20, 'tips': 200,
+		'fastq_samples': 2, 'reads': 2000
+	},
+	'medium': {
+		'samples': 16, 'mutations': 2000, 'contig_length': 500000,
+		'reports': 500, 'sequences': 100, 'tips': 5000,
+		'fastq_samples': 4, 'reads': 25000
+	},
+	'large': {
+		'samples': 64, 'mutations': 20000, 'contig_length': 5000000,
+		'reports': 5000, 'sequences': 200, 'tips': 100000,
+		'fastq_samples': 8, 'reads': 200000
+	}
+}
+
+DEFAULT_BASELINE = Path(__file__).parent / "baselines.json"
+# Differences in wall time below this many seconds are timer noise and never count as a regression.
+MIN_TIME_DELTA = 0.005
+
+
+@dataclass
+class BenchmarkResult:
+	name: str
+	seconds: float
+	peak_memory: int  # bytes
+	items: int
+
+	@property
+	def throughput(self) -> float:
+		return self.items / max(self.seconds, 1E-9)
+
+
+def _import(module_name: str):
+	""" Imports a module of this package, whether the suite is run from the package or from the repository folder."""
+	try:
+		return importlib.import_module('..' + module_name, __package__)
+	except (ImportError, TypeError):
+		return importlib.import_module(module_name)
+
+
+def _contigs(size: Dict) -> Dict[str, int]:
+	return {'NC_000913': size['contig_length'], 'NC_000914': size['contig_length'] // 10}
+
+
+def setup_breseq(folder: Path, size: Dict, seed: int) -> Callable[[], int]:
+	Breseq = _import('breseq.breseq_parser').Breseq
+	breseq_folder = folder / "breseq"
+	if not breseq_folder.exists():
+		for sample in range(size['samples']):
+			output = breseq_folder / "sample{}".format(sample) / "output"
+			output.mkdir(parents = True)
+			generators.write_breseq_index(output / "index.html", size['mutations'], size['mutations'] // 10,
+				size['mutations'] // 10, seed + sample, polymorphic = sample % 2 == 1)
+
+	options = argparse.Namespace(directory = str(breseq_folder))
+
+	def run() -> int:
+		return len(Breseq(options).snp_table)
+
+	return run
+
+
+def _isolate_set_folder(folder: Path, size: Dict, seed: int) -> Path:
+	isolate_set_folder = folder / "isolates"
+	if not isolate_set_folder.exists():
+		for sample in range(size['samples']):
+			generators.write_breseq_folder(isolate_set_folder / "sample{}".format(sample), size['mutations'],
+				_contigs(size), seed + sample)
+	return isolate_set_folder
+
+
+def setup_genome_diff(folder: Path, size: Dict, seed: int) -> Callable[[], int]:
+	GenomeDiff = _import('breseq.genome_diff_parser').GenomeDiff
+	path = _isolate_set_folder(folder, size, seed) / "sample0" / "output" / "evidence" / "annotated.gd"
+
+	def run() -> int:
+		return len(GenomeDiff(path).mutations)
+
+	return run
+
+
+def setup_isolate(folder: Path, size: Dict, seed: int) -> Callable[[], int]:
+	Isolate = _import('breseq.isolate_parser').Isolate
+	path = _isolate_set_folder(folder, size, seed) / "sample0"
+
+	def run() -> int:
+		isolate = Isolate(path)
+		isolate.generate_output_table()
+		return len(isolate.output_table)
+
+	return run
+
+
+def setup_isolate_set(folder: Path, size: Dict, seed: int) -> Callable[[], int]:
+	IsolateSet = _import('breseq.isolate_set_parser').IsolateSet
+	path = _isolate_set_folder(folder, size, seed)
+
+	def run() -> int:
+		isolate_set = IsolateSet(path, incremental = False)
+		isolate_set.combineIsolateTables()
+		return len(isolate_set.isolate_paths) * size['mutations']
+
+	return run
+
+
+def _report_folder(folder: Path, size: Dict, seed: int) -> Path:
+	report_folder = folder / "reports"
+	if not report_folder.exists():
+		for index in range(1, size['reports'] + 1):
+			generators.write_assembly_report(report_folder, index, size['sequences'], seed)
+	return report_folder
+
+
+def setup_ncbi_report(folder: Path, size: Dict, seed: int) -> Callable[[], int]:
+	NCBIReport = _import('misc_parsers.ncbi_report').NCBIReport
+	paths = sorted(_report_folder(folder, size, seed).glob("*/*_assembly_report.txt"))
+
+	def run() -> int:
+		return sum(len(NCBIReport(path).sequences) for path in paths)
+
+	return run
+
+
+def setup_remap_tree_labels(folder: Path, size: Dict, seed: int) -> Callable[[], int]:
+	tree_labels = _import('phylogeny.tree_labels')
+	paths = sorted(_report_folder(folder, size, seed).glob("*/*_assembly_report.txt"))
+	label_map = tree_labels.build_label_map(paths)
+	tree_path = folder / "tree.nwk"
+	if not tree_path.exists():
+		accessions = [path.parent.name for path in paths]
+		labels = [accessions[index % len(accessions)] for index in range(size['tips'])]
+		generators.write_newick(tree_path, labels, seed)
+	output = folder / "tree.relabeled.nwk"
+
+	def run() -> int:
+		tree_labels.remap_tree_labels(tree_path, label_map, output)
+		return size['tips']
+
+	return run
+
+
+def setup_concatenate_files(folder: Path, size: Dict, seed: int) -> Callable[[], int]:
+	dmux_concat = _import('scripts.dmux_concat')
+	dmux_folder = folder / "dmux"
+	if not dmux_folder.exists():
+		generators.write_fastq_lanes(dmux_folder, "run", size['fastq_samples'], size['reads'], seed = seed)
+	groups = sorted(
+		[i for i in (dmux_folder / "run" / "project" / "fastq").iterdir() if i.name.endswith('_R1_001.fastq.gz')],
+		key = lambda i: i.name
+	)
+	files = [i for i in groups if i.name.startswith('sample0_')]
+	output = folder / "concatenated.fastq.gz"
+
+	def run() -> int:
+		return dmux_concat.concatenate_files(output, files).bytes
+
+	return run
+
+
+BENCHMARKS: Dict[str, Callable[[Path, Dict, int], Callable[[], int]]] = {
+	'breseq':            setup_breseq,
+	'genome_diff':       setup_genome_diff,
+	'isolate':           setup_isolate,
+	'isolate_set':       setup_isolate_set,
+	'ncbi_report':       setup_ncbi_report,
+	'remap_tree_labels': setup_remap_tree_labels,
+	'concatenate_files': setup_concatenate_files
+}
+
+
+def run_benchmark(name: str, folder: Path, size: Dict, seed: int = 0, repeat: int = 3) -> BenchmarkResult:
+	""" Generates the input of a benchmark (if not already in `folder`) and measures its best wall time and peak memory."""
+	# The parsers print their progress, which would swamp the report.
+	with redirect_stdout(io.StringIO()):
+		run = BENCHMARKS[name](folder, size, seed)
+		times = list()
+		items = 0
+		for _ in range(repeat):
+			start = time.perf_counter()
+			items = run()
+			times.append(time.perf_counter() - start)
+
+		tracemalloc.start()
+		try:
+			run()
+			_, peak = tracemalloc.get_traced_memory()
+		finally:
+			tracemalloc.stop()
+	return BenchmarkResult(name, min(times), peak, items)
+
+
+def load_baselines(path: Path) -> Dict[str, Dict[str, Dict]]:
+	if not path.exists():
+		return dict()
+	with path.open('r') as file1:
+		return json.load(file1)
+
+
+def save_baselines(path: Path, size_name: str, results: List[BenchmarkResult]) -> Path:
+	""" Saves the results as the baseline of `size_name`, keeping the baselines of other sizes and benchmarks."""
+	baselines = load_baselines(path)
+	baselines.setdefault(size_name, dict()).update({result.name: asdict(result) for result in results})
+	with path.open('w') as file1:
+		json.dump(baselines, file1, indent = 4, sort_keys = True)
+	return path
+
+
+def find_missing_baselines(results: List[BenchmarkResult], baseline: Dict[str, Dict]) -> List[str]:
+	""" Lists the benchmarks that have no baseline to be compared against."""
+	return [result.name for result in results if not baseline.get(result.name)]
+
+
+def find_regressions(results: List[BenchmarkResult], baseline: Dict[str, Dict], threshold: float,
+		min_time_delta: float = MIN_TIME_DELTA) -> List[str]:
+	"""
+		Lists every result whose wall time or peak memory is more than `threshold` (a fraction) above its baseline.
+		Wall times that are less than `min_time_delta` seconds above the baseline are ignored.
+	"""
+	regressions = list()
+	for result in results:
+		previous = baseline.get(result.name)
+		if not previous: continue
+		for metric in ('seconds', 'peak_memory'):
+			current, expected = getattr(result, metric), previous[metric]
+			if metric == 'seconds' and current - expected < min_time_delta:
+				continue
+			if expected and current > expected * (1 + threshold):
+				regressions.append("{}: {} {:.4g} > {:.4g} (+{:.0%})".format(
+					result.name, metric, current, expected, current / expected - 1))
+	return regressions
+
+
+def format_results(results: List[BenchmarkResult], baseline: Dict[str, Dict]) -> str:
+	lines = ["{:<20}{:>12}{:>14}{:>14}{:>12}".format('benchmark', 'seconds', 'peak MB', 'items/s', 'vs base')]
+	for result in results:
+		previous = baseline.get(result.name)
+		change = "{:+.1%}".format(result.seconds / previous['seconds'] - 1) if previous and previous['seconds'] else ''
+		lines.append("{:<20}{:>12.4f}{:>14.2f}{:>14.0f}{:>12}".format(
+			result.name, result.seconds, result.peak_memory / 1E6, result.throughput, change))
+	return "\n".join(lines)
+
+
+def main(argv: List[str] = None):
+	parser = argparse.ArgumentParser(description = "Times the parsers on synthetic data and checks for regressions against saved baselines.")
+	parser.add_argument(
+		'benchmarks',
+		nargs = '*',
+		help = "The benchmarks to run ({}). Defaults to all of them.".format(", ".join(BENCHMARKS.keys()))
+	)
+	parser.add_argument('-s', '--size', choices = list(SIZES.keys()), default = 'small', help = "The size of the generated data.")
+	parser.add_argument('-r', '--repeat', type = int, default = 3, help = "The number of timed runs of each benchmark. The best is kept.")
+	parser.add_argument('--seed', type = int, default = 0, help = "The seed of the data generators.")
+	parser.add_argument(
+		'--data',
+		help = "A folder to generate the data in. Data already in the folder is reused, so the folder should only be reused with the same size and seed. Defaults to a temporary folder."
+	)
+	parser.add_argument('--baseline', default = str(DEFAULT_BASELINE), help = "The baseline file. Defaults to benchmarks/baselines.json.")
+	parser.add_argument('--save-baseline', action = 'store_true', help = "Save the results as the new baseline of this size.")
+	parser.add_argument(
+		'-t', '--threshold',
+		type = float,
+		default = 0.25,
+		help = "The allowed increase in time or memory over the baseline, as a fraction. Defaults to 0.25."
+	)
+	parser.add_argument(
+		'--min-time-delta',
+		type = float,
+		default = MIN_TIME_DELTA,
+		help = "Increases in wall time below this many seconds are never regressions. Defaults to {}.".format(MIN_TIME_DELTA),
+		dest = 'min_time_delta'
+	)
+	parser.add_argument(
+		'--require-baseline',
+		action = 'store_true',
+		help = "Fail if a benchmark has no baseline, instead of only printing a warning.",
+		dest = 'require_baseline'
+	)
+	parser.add_argument(
+		'--allow-skip',
+		action = 'store_true',
+		help = "Skip benchmarks whose modules cannot be imported (ex. missing optional dependencies) instead of failing.",
+		dest = 'allow_skip'
+	)
+	args = parser.parse_args(argv)
+
+	names = args.benchmarks or list(BENCHMARKS.keys())
+	unknown = [name for name in names if name not in BENCHMARKS]
+	if unknown:
+		parser.error("unknown benchmarks: {}".format(", ".join(unknown)))
+	baseline_path = Path(args.baseline)
+	baseline = load_baselines(baseline_path).get(args.size, dict())
+
+	data_folder = Path(args.data) if args.data else Path(tempfile.mkdtemp(prefix = "cooperlab_benchmarks_"))
+	data_folder.mkdir(parents = True, exist_ok = True)
+	results = list()
+	import_errors = list()
+	try:
+		for name in names:
+			try:
+				result = run_benchmark(name, data_folder, SIZES[args.size], args.seed, args.repeat)
+			except ImportError as exception:
+				print("{} {}: {}".format("Skipping" if args.allow_skip else "Could not import", name, exception))
+				import_errors.append(name)
+				continue
+			results.append(result)
+	finally:
+		if not args.data:
+			shutil.rmtree(str(data_folder), ignore_errors = True)
+
+	print(format_results(results, baseline))
+	if import_errors and not args.allow_skip:
+		# A parser that cannot be imported must not pass the regression check.
+		print("\n{} benchmarks could not run: {}. Use --allow-skip to skip them.".format(len(import_errors), ", ".join(import_errors)))
+		sys.exit(1)
+	if args.save_baseline:
+		save_baselines(baseline_path, args.size, results)
+		print("Saved the baseline to {}".format(baseline_path))
+		return
+
+	missing = find_missing_baselines(results, baseline)
+	if missing:
+		print("\n{}: no '{}' baseline in {} for {}. Run with --save-baseline to create one.".format(
+			"Error" if args.require_baseline else "Warning", args.size, baseline_path, ", ".join(missing)))
+	regressions = find_regressions(results, baseline, args.threshold, args.min_time_delta)
+	if regressions:
+		print("\nRegressions (threshold {:.0%}):".format(args.threshold))
+		for regression in regressions:
+			print("\t" + regression)
+	if regressions or (missing and args.require_baseline):
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
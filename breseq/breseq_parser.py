@@ -11,59 +11,18 @@ import argparse
 import os
 
 from functools import partial
+try:
+	from . import profiling
+	from .table_output import write_table, add_output_arguments, DEFAULT_CHUNK_SIZE
+except:
+	import profiling
+	from table_output import write_table, add_output_arguments, DEFAULT_CHUNK_SIZE
 
 print = partial(print, flush = True)
 Table = List[Dict[str, str]]
 # TODO expand user folder with ~ for the -d flag
 DEBUG = os.name == 'nt'
 
-if not DEBUG:
-	parser = argparse.ArgumentParser(
-		description = "This is a Breseq Mutation Parser.  It Currently outputs only SNPs, Missing Coverage, "
-					  "and New Junction Evidence (wont output junction repeats).  "
-					  "In order to run this program please put all the Breseq directores into a master directory and then "
-					  "parse that directory with the program's -d flag.")
-
-	parser.add_argument(
-		'-d', '--directory',
-		action = "store",
-		help = "Use this flag to indicate the folder with the samples you would like to parse. Each subfolder should have an index.html file.",
-		dest = "directory"
-	)
-	parser.add_argument(
-		'-f', '--format',
-		action = "store",
-		help = "format of the output file.",
-		dest = 'filetype',
-		choices = ['csv', 'tsv', 'xlsx'],
-		default = 'xlsx'
-	)
-	parser.add_argument(
-		'-o', '--output',
-		action = "store",
-		help = "Name of the output file (if in excel format) or folder. Should be a folder if outputting as text files. Defaults to './breseq_output'",
-		default = 'breseq_output',
-		dest = 'filename'
-	)
-
-	args = parser.parse_args()
-
-else:
-
-	class Parser:
-		directory: str
-		filetype: str
-		prefix: str
-
-		def __init__(self, a, b, c):
-			self.directory = a
-			self.filetype = b
-			self.filename = c
-
-
-	test_folder = pathlib.Path(__file__).parent / 'test_data'
-	args = Parser(test_folder, 'xlsx', test_folder.with_name('test_output.xlsx'))
-
 
 def toNumber(string: str) -> int:
 	""" Converts a string to a number"""
@@ -98,10 +57,14 @@ class Breseq:
 			self.coverage_table += coverage_table
 			self.junction_table += junction_table
 
-		self.snp_table = pandas.DataFrame(self.snp_table)
-		self.coverage_table = pandas.DataFrame(self.coverage_table)
-		self.junction_table = pandas.DataFrame(self.junction_table)
-		self.generateComparisonTable(self.snp_table)
+		with profiling.span('breseq.dataframes') as stage:
+			stage.count(len(self.snp_table) + len(self.coverage_table) + len(self.junction_table))
+			self.snp_table = pandas.DataFrame(self.snp_table)
+			self.coverage_table = pandas.DataFrame(self.coverage_table)
+			self.junction_table = pandas.DataFrame(self.junction_table)
+		with profiling.span('breseq.comparison_table') as stage:
+			comparison_table = self.generateComparisonTable(self.snp_table)
+			stage.count(0 if comparison_table is None else len(comparison_table))
 
 	def parseAnalysisFolder(self, folder: pathlib.Path) -> Tuple[Table, Table, Table]:
 		"""
@@ -130,10 +93,17 @@ class Breseq:
 			index_file = folder
 		print("\tIndex File: ", index_file)
 		sample_name = folder.name
-		snp_headers, snp_table, coverage_soup, junction_soup = self._parseIndexFile(index_file)
-		parsed_snp_table = self._parsePredictedMutations(sample_name, snp_headers, snp_table)
-		coverage_table = self._parseCoverage(sample_name, coverage_soup)
-		junction_table = self._parseJunctions(sample_name, junction_soup)
+		with profiling.span('breseq.sample', sample_name):
+			snp_headers, snp_table, coverage_soup, junction_soup = self._parseIndexFile(index_file)
+			with profiling.span('breseq.parse_mutations') as stage:
+				parsed_snp_table = self._parsePredictedMutations(sample_name, snp_headers, snp_table)
+				stage.count(len(parsed_snp_table))
+			with profiling.span('breseq.parse_coverage') as stage:
+				coverage_table = self._parseCoverage(sample_name, coverage_soup)
+				stage.count(len(coverage_table))
+			with profiling.span('breseq.parse_junctions') as stage:
+				junction_table = self._parseJunctions(sample_name, junction_soup)
+				stage.count(len(junction_table))
 		return parsed_snp_table, coverage_table, junction_table
 
 	@staticmethod
@@ -202,19 +172,24 @@ class Breseq:
 		-------
 			snp_header, snp_table, coverage_soup, junction_soup
 		"""
-		with open(filename, 'r') as file1:
-			contents = file1.read()
-
-		soup = BeautifulSoup(contents, 'lxml')
-
-		normal_table = soup.find_all(attrs = {'class': 'normal_table_row'})
-		poly_table = soup.find_all(attrs = {'class': 'polymorphism_table_row'})
-		if len(normal_table):
-			snp_table = normal_table
-		else:
-			snp_table = poly_table
-		snp_table = normal_table + poly_table
-		snp_header_soup, coverage_soup, junction_soup = self._extractIndexFileTables(soup)
+		with profiling.span('breseq.read_index') as stage:
+			with open(filename, 'r') as file1:
+				contents = file1.read()
+			stage.count(len(contents))
+
+		with profiling.span('breseq.parse_html'):
+			soup = BeautifulSoup(contents, 'lxml')
+
+		with profiling.span('breseq.extract_tables') as stage:
+			normal_table = soup.find_all(attrs = {'class': 'normal_table_row'})
+			poly_table = soup.find_all(attrs = {'class': 'polymorphism_table_row'})
+			if len(normal_table):
+				snp_table = normal_table
+			else:
+				snp_table = poly_table
+			snp_table = normal_table + poly_table
+			snp_header_soup, coverage_soup, junction_soup = self._extractIndexFileTables(soup)
+			stage.count(len(snp_table))
 
 		return snp_header_soup, snp_table, coverage_soup, junction_soup
 
@@ -347,7 +322,8 @@ class Breseq:
 
 		return worksheet
 
-	def save(self, filename = None, filetype = None)->None:
+	def save(self, filename = None, filetype = None, compression: Optional[str] = None, level: Optional[int] = None,
+			chunk_size: int = DEFAULT_CHUNK_SIZE)->None:
 		"""
 			Saves the parsed tables to a file.
 		Parameters
@@ -356,27 +332,31 @@ class Breseq:
 			The name of the output file.
 		filetype: {'xlsx', 'tsv', 'csv'}
 			The format of the output file.
+		compression, level, chunk_size:
+			How csv/tsv files are compressed and written. See `to_csv()`.
 
 		Returns
 		-------
 
 		"""
 		if filetype is None:
-			filetype = args.filetype
+			filetype = 'xlsx'
 		filetype = filetype.lower()
 
 		if filename is None:
-			filename = args.filename
+			filename = 'breseq_output'
 		filename = pathlib.Path(filename)
 		if filename.is_dir():
 			filename = filename / 'breseq_output'
 
 		print("Saving to ", filename)
 
-		if filetype == 'xlsx':
-			self.to_excel(filename)
-		else:
-			self.to_csv(filename, filetype)
+		with profiling.span('breseq.export') as stage:
+			stage.count(len(self.snp_table) + len(self.coverage_table) + len(self.junction_table))
+			if filetype == 'xlsx':
+				self.to_excel(filename)
+			else:
+				self.to_csv(filename, filetype, compression, level, chunk_size)
 
 	def to_excel(self, filename:Union[str,pathlib.Path]):
 		"""
@@ -428,7 +408,8 @@ class Breseq:
 
 		wb.save(filename)
 
-	def to_csv(self, folder: Union[str, pathlib.Path], filetype):
+	def to_csv(self, folder: Union[str, pathlib.Path], filetype, compression: Optional[str] = None,
+			level: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE):
 		"""
 			Saves the parsed tables as csv/tsv files.
 		Parameters
@@ -437,6 +418,13 @@ class Breseq:
 
 		filetype: {'csv', 'tsv'}
 
+		compression: {'gzip', 'zstd', None}
+			Compresses the files in a background thread. The '.gz'/'.zst' suffix is added to the filenames.
+		level: int
+			The compression level.
+		chunk_size: int
+			The number of rows serialized at a time.
+
 		Returns
 		-------
 
@@ -444,27 +432,65 @@ class Breseq:
 		if isinstance(folder, str):
 			folder = pathlib.Path(folder)
 		extension = 'tsv' if filetype == 'tsv' else 'csv'
-		snp_filename = str(folder.with_name(folder.stem + '.snp.' + extension).absolute())
-		coverage_filename = str(folder.with_name(folder.stem + '.coverage.' + extension).absolute())
-		junction_filename = str(folder.with_name(folder.stem + '.junction.' + extension).absolute())
+		snp_filename = folder.with_name(folder.stem + '.snp.' + extension).absolute()
+		coverage_filename = folder.with_name(folder.stem + '.coverage.' + extension).absolute()
+		junction_filename = folder.with_name(folder.stem + '.junction.' + extension).absolute()
 
 		delimiter = '\t' if filetype == 'tsv' else ','
-		include_index = False
 
-		self.snp_table.to_csv(snp_filename, sep = delimiter, index = include_index)
-		self.coverage_table.to_csv(coverage_filename, sep = delimiter, index = include_index)
-		self.junction_table.to_csv(junction_filename, sep = delimiter, index = include_index)
+		write_table(self.snp_table, snp_filename, delimiter, compression, level, chunk_size)
+		write_table(self.coverage_table, coverage_filename, delimiter, compression, level, chunk_size)
+		write_table(self.junction_table, junction_filename, delimiter, compression, level, chunk_size)
 
 	def to_vcf(self):
 		raise NotImplementedError
 
-if __name__ == "__main__":
+def main(argv: List[str] = None):
+	parser = argparse.ArgumentParser(
+		description = "This is a Breseq Mutation Parser.  It Currently outputs only SNPs, Missing Coverage, "
+					  "and New Junction Evidence (wont output junction repeats).  "
+					  "In order to run this program please put all the Breseq directores into a master directory and then "
+					  "parse that directory with the program's -d flag.")
+
+	parser.add_argument(
+		'-d', '--directory',
+		action = "store",
+		help = "Use this flag to indicate the folder with the samples you would like to parse. Each subfolder should have an index.html file.",
+		dest = "directory"
+	)
+	parser.add_argument(
+		'-f', '--format',
+		action = "store",
+		help = "format of the output file.",
+		dest = 'filetype',
+		choices = ['csv', 'tsv', 'xlsx'],
+		default = 'xlsx'
+	)
+	parser.add_argument(
+		'-o', '--output',
+		action = "store",
+		help = "Name of the output file (if in excel format) or folder. Should be a folder if outputting as text files. Defaults to './breseq_output'",
+		default = 'breseq_output',
+		dest = 'filename'
+	)
+	add_output_arguments(parser, "csv/tsv output files")
+	profiling.add_profile_argument(parser)
+
+	args = parser.parse_args(argv)
+
 	data_folder = args.directory
-	output_file = pathlib.Path(args.filename)
 	if not data_folder or not pathlib.Path(data_folder).is_dir():
 		print("This is not a valid folder: ", data_folder)
 		print("Please Enter a valid Directory to parse, try the --help flag if you have questions, exiting!")
 		exit(1)
 
+	if args.profile:
+		profiling.enable()
 	obj = Breseq(args)
-	obj.save(args.filename, args.filetype)
+	obj.save(args.filename, args.filetype, args.compression, args.compression_level, args.chunk_size)
+	if args.profile:
+		print("Saved the profile to ", profiling.save_report(pathlib.Path(args.profile)))
+
+
+if __name__ == "__main__":
+	main()
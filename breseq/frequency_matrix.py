@@ -0,0 +1,169 @@
+from pathlib import Path
+from typing import List, Dict, Tuple, Iterable, Optional
+import re
+import numpy
+import pandas
+
+try:
+	from .genome_diff_parser import GenomeDiff
+	from .mutation_matrix import mutation_key
+except:
+	from genome_diff_parser import GenomeDiff
+	from mutation_matrix import mutation_key
+
+
+def _object_array(values: List) -> numpy.ndarray:
+	# Built element-wise so that tuple keys are not expanded into a 2D array.
+	array = numpy.empty(len(values), dtype = object)
+	array[:] = values
+	return array
+
+
+# The mutation descriptions in the breseq index.html file, ex. 'A→G', '+GC', '(T)5→6', 'Δ1,234 bp', '3 bp→GT',
+# '1,234 bp x 2', 'IS1 (+) +9 bp'. '->' is accepted in place of '→' for text that went through unidecode.
+ARROW = '(?:→|->)'
+BRESEQ_MUTATIONS = [
+	('SNP', re.compile(r'^[ACGTN]{0}([ACGTN])$'.format(ARROW))),
+	('INS', re.compile(r'^\+([ACGTN]+)$')),
+	('SUB', re.compile(r'^[0-9,]+ bp{0}([ACGTN]+)$'.format(ARROW))),
+	('DEL', re.compile(r'^(?:Δ|D)[0-9,]+ bp$')),
+	('AMP', re.compile(r'^[0-9,]+ bp (?:x|×) ?[0-9]+$')),
+	('MOB', re.compile(r'^\S+ \([+\-–−]\)'))
+]
+HOMOPOLYMER = re.compile(r'^\(([ACGTN]+)\)([0-9]+){0}([0-9]+)$'.format(ARROW))
+
+
+def breseq_mutation_key(seq_id: str, position: int, mutation: str) -> Tuple:
+	"""
+		Converts a row of the breseq predicted mutation table to the (seq_id, position, type, new_seq) key used by
+		`mutation_key()`, so that matrices built from either source can be compared. Unrecognized descriptions
+		are kept as the new_seq of an untyped key.
+	"""
+	mutation = str(mutation).strip()
+	if not pandas.isna(position):
+		# The table stores positions as floats when any row of the column is missing one.
+		position = int(position)
+	match = HOMOPOLYMER.match(mutation)
+	if match:
+		repeat, before, after = match.groups()
+		if int(after) > int(before):
+			return seq_id, position, 'INS', repeat * (int(after) - int(before))
+		return seq_id, position, 'DEL', ''
+	for mutation_type, pattern in BRESEQ_MUTATIONS:
+		match = pattern.match(mutation)
+		if match:
+			new_seq = match.group(1) if pattern.groups else ''
+			return seq_id, position, mutation_type, new_seq
+	return seq_id, position, '', mutation
+
+
+def _to_frequency(value) -> float:
+	# Mutations without a frequency field are fixed in the sample.
+	if value is None:
+		return 1.0
+	try:
+		return float(value)
+	except (TypeError, ValueError):
+		return numpy.nan
+
+
+class FrequencyMatrix:
+	"""
+		A dense float32 mutation x sample matrix of allele frequencies. Mutations that were not observed in a
+		sample are stored as NaN.
+	Parameters
+	----------
+	mutations: List[tuple]
+		The key of each row.
+	samples: List[str]
+		The name of each column.
+	values: numpy.ndarray
+		The (mutations, samples) frequency matrix.
+	"""
+
+	def __init__(self, mutations: List[tuple], samples: List[str], values: numpy.ndarray):
+		self.mutations = mutations
+		self.samples = samples
+		self.values = values
+
+	@classmethod
+	def from_arrays(cls, keys: List[tuple], samples: List[str], frequencies: Iterable[float],
+			order: Optional[Dict[str, float]] = None) -> 'FrequencyMatrix':
+		"""
+			Builds the matrix from parallel lists of observations.
+		Parameters
+		----------
+		keys: List[tuple]
+			The mutation key of each observation.
+		samples: List[str]
+			The sample of each observation.
+		frequencies: Iterable[float]
+			The frequency of each observation, as a fraction.
+		order: Dict[str, float]
+			Optional sample metadata (ex. timepoints) used to order the columns. Samples missing from the
+			mapping are placed last.
+		"""
+		row_codes, row_keys = pandas.factorize(_object_array(keys))
+		column_codes, column_keys = pandas.factorize(_object_array(samples))
+		column_keys = list(column_keys)
+		if order is not None:
+			ranked = sorted(range(len(column_keys)), key = lambda i: (column_keys[i] not in order, order.get(column_keys[i], 0)))
+			rank = numpy.empty(len(ranked), dtype = numpy.int64)
+			rank[ranked] = numpy.arange(len(ranked))
+			column_codes = rank[column_codes]
+			column_keys = [column_keys[i] for i in ranked]
+
+		values = numpy.full((len(row_keys), len(column_keys)), numpy.nan, dtype = numpy.float32)
+		values[row_codes, column_codes] = numpy.asarray(list(frequencies), dtype = numpy.float32)
+		return cls(list(row_keys), column_keys, values)
+
+	@classmethod
+	def from_genome_diffs(cls, samples: Dict[str, GenomeDiff], order: Optional[Dict[str, float]] = None) -> 'FrequencyMatrix':
+		""" Builds the matrix from the `frequency` field of each sample's mutations."""
+		keys, names, frequencies = list(), list(), list()
+		for sample, gd in samples.items():
+			for mutation in gd.mutations:
+				keys.append(mutation_key(mutation))
+				names.append(sample)
+				frequencies.append(_to_frequency(mutation.get('frequency')))
+		return cls.from_arrays(keys, names, frequencies, order)
+
+	@classmethod
+	def from_breseq_table(cls, snp_table: pandas.DataFrame, order: Optional[Dict[str, float]] = None) -> 'FrequencyMatrix':
+		"""
+			Builds the matrix from the `freq %` column of the predicted mutation table generated by `Breseq`. Rows
+			without a frequency (ex. samples that were not run in polymorphism mode) are fixed mutations.
+		"""
+		keys = [breseq_mutation_key(*row) for row in zip(snp_table['seq id'], snp_table['position'], snp_table['mutation'])]
+		if 'freq %' in snp_table.columns:
+			frequencies = pandas.to_numeric(snp_table['freq %'], errors = 'coerce').fillna(100) / 100
+		else:
+			frequencies = numpy.ones(len(snp_table))
+		return cls.from_arrays(keys, list(snp_table['Sample']), frequencies, order)
+
+	def to_frame(self) -> pandas.DataFrame:
+		return pandas.DataFrame(self.values, index = pandas.Index(self.mutations, tupleize_cols = False), columns = self.samples)
+
+	def save(self, path: Path) -> Path:
+		""" Saves the matrix as an uncompressed .npz file, which can be loaded without parsing."""
+		path = path.with_suffix('.npz')
+		seq_ids, positions, types, new_seqs = zip(*self.mutations) if self.mutations else ((), (), (), ())
+		numpy.savez(
+			str(path),
+			values = self.values,
+			seq_ids = numpy.array(seq_ids, dtype = str),
+			positions = numpy.array(positions, dtype = numpy.int64),
+			types = numpy.array(types, dtype = str),
+			new_seqs = numpy.array(new_seqs, dtype = str),
+			samples = numpy.array(self.samples, dtype = str)
+		)
+		return path
+
+	@classmethod
+	def load(cls, path: Path) -> 'FrequencyMatrix':
+		""" Loads a matrix saved with `save()`. Mutation keys are loaded as (seq_id, position, type, new_seq) tuples."""
+		with numpy.load(str(path)) as data:
+			mutations = list(zip(
+				data['seq_ids'].tolist(), data['positions'].tolist(), data['types'].tolist(), data['new_seqs'].tolist()
+			))
+			return cls(mutations, data['samples'].tolist(), data['values'])
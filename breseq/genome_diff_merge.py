@@ -0,0 +1,142 @@
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+import heapq
+import itertools
+import tempfile
+
+try:
+	from .genome_diff_parser import GenomeDiff, Mutation
+except:
+	from genome_diff_parser import GenomeDiff, Mutation
+
+MergeKey = Tuple[str, int, str, str]
+
+
+def merge_key(mutation: Mutation) -> MergeKey:
+	""" Mutations are merged in (seq_id, position, type) order. new_seq separates different mutations at the same site."""
+	return mutation.seq_id, mutation.position or 0, mutation.type, mutation.new_seq
+
+
+def _row_key(line: str) -> MergeKey:
+	return merge_key(GenomeDiff.parse_row(line.rstrip('\n').split('\t')))
+
+
+def _is_mutation_line(line: str) -> bool:
+	return len(line.split('\t', 1)[0]) == 3 and not line.startswith('#')
+
+
+# The number of mutation lines sorted in memory at a time when a file is not already in merge order.
+SORT_RUN_SIZE = 100000
+
+
+def _is_sorted(path: Path) -> bool:
+	previous = None
+	with path.open('r', encoding = 'utf-8') as gd_file:
+		for line in gd_file:
+			if not _is_mutation_line(line):
+				continue
+			key = _row_key(line)
+			if previous is not None and key < previous:
+				return False
+			previous = key
+	return True
+
+
+def _write_run(lines: List[str], temporary_folder: Path) -> Path:
+	lines.sort(key = _row_key)
+	with tempfile.NamedTemporaryFile('w', encoding = 'utf-8', suffix = '.gd', dir = str(temporary_folder), delete = False) as run_file:
+		run_file.writelines(line if line.endswith('\n') else line + '\n' for line in lines)
+	return Path(run_file.name)
+
+
+def _sorted_mutations(path: Path, temporary_folder: Path, run_size: int = SORT_RUN_SIZE) -> Iterator[Mutation]:
+	"""
+		Yields the mutations of `path` in merge order. Files that are already sorted are streamed directly. Other files
+		are sorted externally: runs of `run_size` mutations are sorted into temporary files, which are then merged, so
+		at most one run is held in memory.
+	"""
+	if _is_sorted(path):
+		yield from GenomeDiff.iter_mutations(path)
+		return
+
+	runs = list()
+	lines = list()
+	with path.open('r', encoding = 'utf-8') as gd_file:
+		for line in gd_file:
+			if not _is_mutation_line(line):
+				continue
+			lines.append(line)
+			if len(lines) >= run_size:
+				runs.append(_write_run(lines, temporary_folder))
+				lines = list()
+	if lines:
+		runs.append(_write_run(lines, temporary_folder))
+	yield from heapq.merge(*(GenomeDiff.iter_mutations(run) for run in runs), key = merge_key)
+
+
+def _keyed(sample_index: int, mutations: Iterator[Mutation]) -> Iterator[Tuple[MergeKey, int, Mutation]]:
+	for mutation in mutations:
+		yield merge_key(mutation), sample_index, mutation
+
+
+def iter_merged(sources: Dict[str, Path], temporary_folder: Path) -> Iterator[Tuple[MergeKey, List[Tuple[str, Mutation]]]]:
+	"""
+		Streams a k-way merge of several .gd files. Only one mutation per file is held in memory at a time.
+
+		Yields
+		------
+			(key, [(sample, mutation), ...]) for every unique mutation, in (seq_id, position, type) order.
+	"""
+	samples = list(sources.keys())
+	streams = [
+		_keyed(index, _sorted_mutations(path, temporary_folder))
+		for index, path in enumerate(sources.values())
+	]
+	merged = heapq.merge(*streams, key = lambda item: (item[0], item[1]))
+	for key, group in itertools.groupby(merged, key = lambda item: item[0]):
+		yield key, [(samples[index], mutation) for _, index, mutation in group]
+
+
+def _frequency(mutation: Mutation) -> str:
+	return mutation.named_fields.get('frequency', '1')
+
+
+def merge_genome_diffs(sources: Dict[str, Path], output: Path, filetype: str = 'gd') -> int:
+	"""
+		Merges the mutations of many .gd files into a single comparison file with one record per unique mutation.
+	Parameters
+	----------
+	sources: Dict[str, Path]
+		Maps each sample name to its .gd file.
+	output: Path
+		The output file.
+	filetype: {'gd', 'tsv'}
+		'gd' writes a GenomeDiff file where each mutation has a `frequency_<sample>` field for every sample it was found
+		in. 'tsv' writes a table with one frequency column per sample, empty where the mutation is absent.
+
+	Returns
+	-------
+		The number of unique mutations written.
+	"""
+	samples = list(sources.keys())
+	count = 0
+	with tempfile.TemporaryDirectory() as temporary_folder, output.open('w', encoding = 'utf-8') as output_file:
+		if filetype == 'tsv':
+			output_file.write("\t".join(['seq_id', 'position', 'type', 'new_seq', 'size', 'samples'] + samples) + "\n")
+		else:
+			output_file.write("#=GENOME_DIFF\t1.0\n")
+			output_file.write("#=SAMPLES\t{}\n".format(",".join(samples)))
+
+		for count, (key, group) in enumerate(iter_merged(sources, Path(temporary_folder)), start = 1):
+			seq_id, position, mutation_type, new_seq = key
+			first = group[0][1]
+			frequencies = {sample: _frequency(mutation) for sample, mutation in group}
+			if filetype == 'tsv':
+				size = '' if first.size is None else first.size
+				row = [seq_id, position, mutation_type, new_seq, size, len(group)] + [frequencies.get(i, '') for i in samples]
+				output_file.write("\t".join(map(str, row)) + "\n")
+			else:
+				positional = [value for _, value in first.fields]
+				named = ["frequency_{}={}".format(sample, frequency) for sample, frequency in frequencies.items()]
+				output_file.write("\t".join([mutation_type, str(count), '.'] + positional + named) + "\n")
+	return count
@@ -1,13 +1,23 @@
 from pathlib import Path
-from typing import List, Dict, Union, Iterable, Tuple
+from typing import List, Dict, Union, Iterable, Iterator, Optional, Tuple
 import re
 from dataclasses import dataclass
 import yaml
 import json
+import numpy
 from Bio import SeqIO
+try:
+	from . import profiling
+except:
+	import profiling
 
 Row = List[str]
 
+# Mutation types whose VCF REF allele covers `size` bases. All other types use the single base at `position`.
+# Deletions also include the base before them, which is kept as the ALT allele.
+VCF_SPAN_TYPES = {'SUB', 'DEL', 'INV'}
+COMPLEMENT = str.maketrans('ACGTNacgtn', 'TGCANtgcan')
+
 regex = "([\w]+)[=]([^\t]+)"
 regex = re.compile(regex)
 
@@ -99,25 +109,68 @@ class Mutation:
 	def get(self, item):
 		return self.fields_dict.get(item, self.named_fields.get(item))
 
-	def to_vcf(self, reference: str):
-		if self.type == 'INS':
-			reference_sequence = get_position(reference, self.position)
-			alternate_sequence = reference_sequence + self.new_seq
-		elif self.type == 'SNP':
-			reference_sequence = get_position(reference, self.position)
+	def get_reference_span(self) -> Tuple[int, int]:
+		"""
+			The 0-based start and the length of the reference bases used as the VCF REF allele. The start is also the
+			VCF POS - 1. Deletions are anchored on the base before them, or the base after them at the start of a contig.
+		"""
+		if self.type == 'DEL':
+			return max(self.position - 2, 0), self.size + 1
+		if self.type in VCF_SPAN_TYPES:
+			return self.position - 1, self.size
+		return self.position - 1, 1
+
+	def check_reference_span(self, contig_length: int):
+		""" Raises a ValueError if the REF allele of this mutation does not fit in a contig of `contig_length` bases."""
+		start, length = self.get_reference_span()
+		if start < 0 or start + length > contig_length:
+			message = "Mutation '{}' ({} at {}:{}) lies outside of the reference sequence, which is {} bp long.".format(
+				self.id, self.type, self.seq_id, self.position, contig_length)
+			raise ValueError(message)
+
+	def get_vcf_alleles(self, reference_sequence: str) -> Tuple[str, str, List[Tuple[str, str]]]:
+		"""
+			Builds the REF and ALT alleles from the reference bases at `get_reference_span()`. MOB, AMP and CON mutations
+			use symbolic ALT alleles.
+
+			Returns
+			-------
+				ref, alt, extra info fields
+		"""
+		info = list()
+		if self.type == 'SNP':
 			alternate_sequence = self.new_seq
+		elif self.type == 'INS':
+			alternate_sequence = reference_sequence + self.new_seq
 		elif self.type == 'SUB':
-			reference_sequence = get_position(reference, (self.position, self.position + self.size))
 			alternate_sequence = self.new_seq
 		elif self.type == 'DEL':
-			reference_sequence = get_position(reference, (self.position, self.position + self.size))
-			alternate_sequence = '.'
+			# The anchor base that remains after the deletion.
+			alternate_sequence = reference_sequence[0] if self.position > 1 else reference_sequence[-1]
 		elif self.type == 'INV':
-			reference_sequence = get_position(reference, (self.position, self.position + self.size))
-			alternate_sequence = reference_sequence[::-1]
+			alternate_sequence = reference_sequence[::-1].translate(COMPLEMENT)
+		elif self.type == 'MOB':
+			alternate_sequence = '<INS:ME:{}>'.format(self.get('repeat_name'))
+			info = [('STRAND', self.get('strand')), ('DS', self.get('duplication_size'))]
+		elif self.type == 'AMP':
+			alternate_sequence = '<DUP>'
+			info = [('SVLEN', self.size), ('END', self.position + self.size - 1), ('CN', self.get('new_copy_number'))]
+		elif self.type == 'CON':
+			alternate_sequence = '<CON>'
+			info = [('SVLEN', self.size), ('END', self.position + self.size - 1), ('REGION', self.get('region'))]
 		else:
 			message = "'{}' Invalid mutation type!".format(self.type)
 			raise ValueError(message)
+		return reference_sequence, alternate_sequence, info
+
+	def to_vcf(self, reference: str) -> 'VcfRecord':
+		reference = getattr(reference, 'seq', reference)
+		self.check_reference_span(len(reference))
+		start, length = self.get_reference_span()
+		return self._vcf_record(str(reference[start:start + length]))
+
+	def _vcf_record(self, reference_sequence: str) -> 'VcfRecord':
+		reference_sequence, alternate_sequence, extra_info = self.get_vcf_alleles(reference_sequence)
 
 		vcf_pass = "PASS"
 		vcf_info = [
@@ -127,16 +180,54 @@ class Mutation:
 			# ('GN', self.get('gene_name')),
 			# ('LT', self.get('locus_tag')),
 			('CAT', self.get('mutation_category'))
-		]
+		] + extra_info
 		vcf_info = sorted(vcf_info)
 		vcf_info = ['{}={}'.format(i, j).replace(' ', '') for i, j in vcf_info]
 
-		record = VcfRecord(self.seq_id, self.position, '.', reference_sequence, alternate_sequence, vcf_pass, '.',
+		position = self.get_reference_span()[0] + 1
+		record = VcfRecord(self.seq_id, position, '.', reference_sequence, alternate_sequence, '.', vcf_pass,
 						   vcf_info)
 
 		return record
 
 
+def mutations_to_vcf(mutations: List[Mutation], reference: Dict[str, str]) -> List[VcfRecord]:
+	"""
+		Converts many mutations to VCF records. The REF bases of all mutations on a contig are fetched with a single
+		numpy gather over that contig instead of one slice per mutation.
+	Parameters
+	----------
+	mutations: List[Mutation]
+	reference: Dict[str, str]
+		Maps each seq_id to its sequence. Accepts strings, Bio.Seq objects or SeqRecords.
+
+	Returns
+	-------
+		The records, in the same order as `mutations`.
+	"""
+	records: List[Optional[VcfRecord]] = [None] * len(mutations)
+	groups: Dict[str, List[int]] = dict()
+	for index, mutation in enumerate(mutations):
+		groups.setdefault(mutation.seq_id, list()).append(index)
+
+	for seq_id, indices in groups.items():
+		sequence = reference[seq_id]
+		sequence = str(getattr(sequence, 'seq', sequence)).encode('ascii')
+		contig = numpy.frombuffer(sequence, dtype = numpy.uint8)
+		spans = numpy.array([mutations[i].get_reference_span() for i in indices], dtype = numpy.int64).reshape(-1, 2)
+		starts, lengths = spans[:, 0], spans[:, 1]
+		outside = numpy.flatnonzero((starts < 0) | (starts + lengths > len(contig)))
+		if len(outside):
+			mutations[indices[outside[0]]].check_reference_span(len(contig))
+		ends = numpy.cumsum(lengths)
+		# Index of every REF base of every mutation, laid out end to end.
+		gather = numpy.arange(ends[-1] if len(ends) else 0) + numpy.repeat(starts - (ends - lengths), lengths)
+		bases = contig[gather].tobytes().decode('ascii')
+		for index, end, length in zip(indices, ends.tolist(), lengths.tolist()):
+			records[index] = mutations[index]._vcf_record(bases[end - length:end])
+	return records
+
+
 def get_position(genome: str, position: Union[int, Iterable[int]]) -> str:
 	if isinstance(position, str): position = int(position)
 	if isinstance(position, int):
@@ -160,11 +251,15 @@ class GenomeDiff:
 	"""
 
 	def __init__(self, path: Path):
-		with path.open('r', encoding='utf-8') as gd_file:
-			contents = gd_file.read().split('\n')
-			contents = [r.split('\t') for r in contents]
+		with profiling.span('genome_diff.read') as stage:
+			with path.open('r', encoding='utf-8') as gd_file:
+				contents = gd_file.read().split('\n')
+				contents = [r.split('\t') for r in contents]
+			stage.count(len(contents))
 
-		self.mutations, self.evidence = self.parse(contents)
+		with profiling.span('genome_diff.parse') as stage:
+			self.mutations, self.evidence = self.parse(contents)
+			stage.count(len(self.mutations) + len(self.evidence))
 
 		self.mutation_map = {(key.seq_id, key.position):index for index, key in enumerate(self.mutations)}
 		self.evidence_map = {key.id: index for index, key in enumerate(self.evidence)}
@@ -196,16 +291,26 @@ class GenomeDiff:
 
 		return mutations, evidence
 
-	def parse_row(self, row: Row) -> Mutation:
+	@classmethod
+	def parse_row(cls, row: Row) -> Mutation:
 		mutation_type = row[0]
 		field_keys = TYPE_SPECIFIC_FIELDS[mutation_type]
 		field_keys = ['type', 'id', 'parent_id'] + list(field_keys)
 		fields = [(f, r) for f, r in zip(field_keys, row[:len(field_keys) + 3])]
 
-		named_fields = self.get_named_fields(row)
+		named_fields = cls.get_named_fields(row)
 		mutation = Mutation(*fields, **named_fields)
 		return mutation
 
+	@classmethod
+	def iter_mutations(cls, path: Path) -> Iterator[Mutation]:
+		""" Yields the mutations of a .gd file one line at a time, without loading the whole file."""
+		with path.open('r', encoding = 'utf-8') as gd_file:
+			for line in gd_file:
+				row = line.rstrip('\n').split('\t')
+				if len(row[0]) == 3 and row[0] in TYPE_SPECIFIC_FIELDS:
+					yield cls.parse_row(row)
+
 	@staticmethod
 	def get_named_fields(row: Row) -> Dict[str, str]:
 		named_fields = [regex.search(i) for i in row]
@@ -229,23 +334,17 @@ class GenomeDiff:
 			with path.open('w') as file1:
 				file1.write(json.dumps(data, sort_keys = True, indent = 4))
 
+	def to_vcf_records(self, reference: Dict[str, str]) -> List[VcfRecord]:
+		""" Converts every mutation to a VCF record. See `mutations_to_vcf()`."""
+		return mutations_to_vcf(self.mutations, reference)
+
 	def to_vcf(self, reference: Path, path: Path = None):
-		lines = list()
 		reference = SeqIO.parse(reference, "fasta")
 		reference = SeqIO.to_dict(reference)
-		for mutation in self.mutations:
-			ref_seq = reference[mutation.seq_id]
-			line = mutation.to_vcf(ref_seq.seq)
-			lines.append(str(line))
+		lines = [str(line) for line in self.to_vcf_records(reference)]
 
 		if path:
 			with path.open('w') as vcf_file:
-				vcf_file.writelines(lines)
+				vcf_file.write("\n".join(lines) + "\n")
 		print("\n".join(lines))
 		return lines
-
-
-if __name__ == "__main__":
-	path = Path.home() / "Documents" / "output.gd"
-	path = Path.home() / "Documents" / "projects" / "Moreira-POR" / "Breseq Output" / "P148-1" / "output" / "evidence" / "annotated.gd"
-	gd = GenomeDiff(path)
@@ -1,67 +1,153 @@
 from pathlib import Path
+from typing import Dict, List, Optional
+import argparse
 from Bio import SeqIO
 import pandas
 try:
 	from .genome_diff_parser import GenomeDiff
+	from . import profiling
+	from .table_output import compressed_path, write_table, add_output_arguments, DEFAULT_CHUNK_SIZE
 except:
 	from genome_diff_parser import GenomeDiff
+	import profiling
+	from table_output import compressed_path, write_table, add_output_arguments, DEFAULT_CHUNK_SIZE
+
+# Column types of the per-isolate output table. Shared with IsolateSet so the combined table/dataset is typed consistently.
+OUTPUT_TABLE_DTYPES = {
+	'sample':       'category',
+	'ref':          'object',
+	'alt':          'object',
+	'position':     'Int64',
+	'sequenceId':   'category',
+	'mutationType': 'category'
+}
+
+
 class Isolate:
 	def __init__(self, path:Path):
 		assert path.is_dir()
 		self.path = path
 		self.sample_id = path.stem
 		self.output_folder = path / "sample_output"
-		if not self.output_folder: self.output_folder.mkdir()
+		if not self.output_folder.exists(): self.output_folder.mkdir()
+		self.output_table_path = self.output_folder / "output_table.tsv"
+		self.output_table: Optional[pandas.DataFrame] = None
 		self.output_vcf = path / "data" / "output.vcf"
-		self.output_gd_basic = path / "output" / "output.gd"
-		self.output_gd_evidence = path / "output" / "evidence" / "evidence.gd"
-		self.output_gd_annotated = path / "output" / "evidence" / "annotated.gd"
+		inputs = self.input_files(path)
+		self.output_gd_basic = inputs['output_gd_basic']
+		self.output_gd_evidence = inputs['output_gd_evidence']
+		self.output_gd_annotated = inputs['output_gd_annotated']
 		self.index = path / "output" / "index.html"
-		self.reference = path / "data" / "reference.fasta"
+		self.reference = inputs['reference']
 
-		self.output_gd_annotated = GenomeDiff(self.output_gd_annotated)
-		self.output_gd_evidence = GenomeDiff(self.output_gd_evidence)
-		self.output_gd_basic = GenomeDiff(self.output_gd_basic)
+		with profiling.span('isolate.load_genome_diffs', self.sample_id) as stage:
+			self.output_gd_annotated = GenomeDiff(self.output_gd_annotated)
+			self.output_gd_evidence = GenomeDiff(self.output_gd_evidence)
+			self.output_gd_basic = GenomeDiff(self.output_gd_basic)
+			stage.count(3)
 
 		#self.generate_output_table()
-		reference = SeqIO.to_dict(SeqIO.parse(self.reference, "fasta"))
 		#self.output_gd_annotated.to_vcf(self.reference)
 
 
+	@staticmethod
+	def input_files(path: Path) -> Dict[str, Path]:
+		""" The files in a breseq output folder that an Isolate is parsed from."""
+		return {
+			'output_gd_basic':     path / "output" / "output.gd",
+			'output_gd_evidence':  path / "output" / "evidence" / "evidence.gd",
+			'output_gd_annotated': path / "output" / "evidence" / "annotated.gd",
+			'reference':           path / "data" / "reference.fasta"
+		}
+
 	def combine_output_files(self):
 		""" Combines all relevant outputfiles into a single table."""
 		pass
 
-	def generate_output_table(self, path:Path=None)->Path:
+	def generate_output_table(self, path:Path=None, compression: Optional[str] = None, level: Optional[int] = None,
+			chunk_size: int = DEFAULT_CHUNK_SIZE)->Path:
+		"""
+			Builds the annotated mutation table and saves it as a tsv file. The table is kept in `self.output_table`
+			so that IsolateSet can combine it without reading it back from disk.
+		Parameters
+		----------
+		path: Path
+			Where to save the table. Defaults to `self.output_table_path`.
+		compression: {'gzip', 'zstd', None}
+			Compresses the table in a background thread. The '.gz'/'.zst' suffix is added to `path`.
+		level: int
+			The compression level.
+		chunk_size: int
+			The number of rows serialized at a time.
+
+		Returns
+		-------
+			The path to the saved table.
+		"""
 		output_table = list()
-		record_dict = SeqIO.to_dict(SeqIO.parse(self.reference, "fasta"))
-		for index, mutation in enumerate(self.output_gd_annotated.mutations):
-			seq_id = mutation.get('seq_id')
-			ref_seq = record_dict[seq_id]
-			vcf_record = mutation.to_vcf(ref_seq)
-
-			row = {
-				'sample': self.sample_id,
-				#'gene': mutation.get('gene_name'),
-				'ref': vcf_record.REF,
-				'alt': vcf_record.ALT,
-				'position': mutation.position,
-				'sequenceId': mutation.seq_id,
-				'mutationType': mutation.type
-			}
-			output_table.append(row)
-
-		output_file = self.output_folder / "annotated_table.tsv"
-		df = pandas.DataFrame(output_table)
-		df.to_csv(str(output_file), sep = '\t', index = False)
-		return output_file
+		with profiling.span('isolate.load_reference', self.sample_id) as stage:
+			record_dict = SeqIO.to_dict(SeqIO.parse(self.reference, "fasta"))
+			stage.count(len(record_dict))
+		with profiling.span('isolate.vcf_records', self.sample_id) as stage:
+			vcf_records = self.output_gd_annotated.to_vcf_records(record_dict)
+			stage.count(len(vcf_records))
+		with profiling.span('isolate.build_table', self.sample_id) as stage:
+			for mutation, vcf_record in zip(self.output_gd_annotated.mutations, vcf_records):
+				row = {
+					'sample': self.sample_id,
+					#'gene': mutation.get('gene_name'),
+					'ref': vcf_record.REF,
+					'alt': vcf_record.ALT,
+					'position': mutation.position,
+					'sequenceId': mutation.seq_id,
+					'mutationType': mutation.type
+				}
+				output_table.append(row)
+			df = pandas.DataFrame(output_table, columns = list(OUTPUT_TABLE_DTYPES.keys()))
+			self.output_table = df.astype(OUTPUT_TABLE_DTYPES)
+			stage.count(len(self.output_table))
 
-if __name__ == "__main__":
-	path = Path.home() / "Documents" / "projects" / "Moreira-POR" / "Breseq Output" / "P148-1"
+		if path is None:
+			path = self.output_table_path
+		path = compressed_path(path, compression)
+		self.output_table_path = path
+		with profiling.span('isolate.write_table', self.sample_id) as stage:
+			write_table(self.output_table, path, '\t', compression, level, chunk_size)
+			stage.count(len(self.output_table))
+		return path
+
+	def get_output_table(self)->pandas.DataFrame:
+		""" Returns the output table, preferring the in-memory copy over the saved file and generating it if neither exists."""
+		if self.output_table is None:
+			if self.output_table_path.exists():
+				df = pandas.read_table(self.output_table_path, sep = '\t')
+				self.output_table = df.astype(OUTPUT_TABLE_DTYPES)
+			else:
+				self.generate_output_table()
+		return self.output_table
+
+def main(argv: List[str] = None):
+	parser = argparse.ArgumentParser(description = "Generates the annotated mutation table of a single breseq output folder.")
+	parser.add_argument('path', help = "The breseq output folder.")
+	parser.add_argument(
+		'-o', '--output',
+		action = "store",
+		help = "Where to save the table. Defaults to '<path>/sample_output/output_table.tsv'",
+		dest = 'output'
+	)
+	add_output_arguments(parser, "table")
+	profiling.add_profile_argument(parser)
+	args = parser.parse_args(argv)
 
-	isolate = Isolate(path)
-	isolate_output = path / "isolate_output"
-	if not isolate_output.exists():
-		isolate_output.mkdir()
+	if args.profile:
+		profiling.enable()
+	isolate = Isolate(Path(args.path))
+	output_file = isolate.generate_output_table(Path(args.output) if args.output else None, args.compression,
+		args.compression_level, args.chunk_size)
+	print("Saved the table to", output_file)
+	if args.profile:
+		print("Saved the profile to", profiling.save_report(Path(args.profile)))
 
-	isolate.generate_output_table(isolate_output / "output_table.tsv")
\ No newline at end of file
+
+if __name__ == "__main__":
+	main()
@@ -1,37 +1,271 @@
 from pathlib import Path
-import pandas
+from typing import Dict, List, Optional
+import argparse
+import hashlib
+import json
+import shutil
 
 try:
 	from .isolate_parser import Isolate
+	from .mutation_matrix import MutationMatrix
+	from .frequency_matrix import FrequencyMatrix
+	from .genome_diff_merge import merge_genome_diffs
+	from . import profiling
+	from .table_output import CompressedWriter, compressed_path, open_table, write_table_chunks, add_output_arguments, DEFAULT_CHUNK_SIZE
 except:
 	from isolate_parser import Isolate
+	from mutation_matrix import MutationMatrix
+	from frequency_matrix import FrequencyMatrix
+	from genome_diff_merge import merge_genome_diffs
+	import profiling
+	from table_output import CompressedWriter, compressed_path, open_table, write_table_chunks, add_output_arguments, DEFAULT_CHUNK_SIZE
+
+
+def file_fingerprint(path: Path, previous: Optional[Dict] = None) -> Dict:
+	"""
+		Returns the size, mtime and md5 of a file. The md5 is only recomputed when the size or mtime differ
+		from `previous`.
+	"""
+	stat = path.stat()
+	fingerprint = {'size': stat.st_size, 'mtime': stat.st_mtime}
+	if previous and previous.get('size') == stat.st_size and previous.get('mtime') == stat.st_mtime:
+		fingerprint['md5'] = previous.get('md5')
+	else:
+		md5 = hashlib.md5()
+		with path.open('rb') as file1:
+			for chunk in iter(lambda: file1.read(1024 * 1024), b''):
+				md5.update(chunk)
+		fingerprint['md5'] = md5.hexdigest()
+	return fingerprint
 
 
 class IsolateSet:
-	def __init__(self, path: Path):
-		""" Parses a folder containing a number of breseq output folders."""
+	"""
+		Parses a folder containing a number of breseq output folders.
+
+		A manifest of each isolate's input files and output table is kept in the output folder. When `incremental`
+		is True, isolates whose inputs have not changed since the last run are not parsed again and their previous
+		output tables are reused. The manifest also records the inputs each combined output was built from, so each
+		output (the tsv file, every parquet partition) is only reused when its own inputs are unchanged.
+	Parameters
+	----------
+	path: Path
+		The folder containing the breseq output folders.
+	incremental: bool
+		Whether to reuse the outputs of unchanged isolates.
+	"""
+
+	def __init__(self, path: Path, incremental: bool = True):
 		self.output_folder = path / "isolate_set_output"
 		if not self.output_folder.exists():
 			self.output_folder.mkdir()
-		self.samples = list()
-		for sample in path.iterdir():
-			s = Isolate(sample)
-			self.samples.append(s)
+		self.manifest_path = self.output_folder / "manifest.json"
+		previous = self.load_manifest() if incremental else dict()
+		previous_manifest = previous.get('isolates', dict())
+
+		self.isolate_paths: Dict[str, Path] = dict()
+		self.manifest: Dict[str, Dict] = dict()
+		# output name -> the input state of each isolate when that output was written.
+		self.combined: Dict[str, Dict[str, str]] = previous.get('combined', dict())
+		self.changed: List[str] = list()
+		self._isolates: Dict[str, Isolate] = dict()
+		for sample in sorted(path.iterdir()):
+			if sample == self.output_folder or not sample.is_dir(): continue
+			sample_id = sample.stem
+			previous = previous_manifest.get(sample_id, dict())
+			previous_inputs = previous.get('inputs', dict())
+			with profiling.span('isolate_set.fingerprint', sample_id) as stage:
+				inputs = {
+					key: file_fingerprint(filename, previous_inputs.get(key))
+					for key, filename in Isolate.input_files(sample).items()
+				}
+				stage.count(len(inputs))
+			output_table = previous.get('outputs', dict()).get('table')
+			unchanged = inputs == previous_inputs and bool(output_table) and Path(output_table).exists()
+
+			self.isolate_paths[sample_id] = sample
+			self.manifest[sample_id] = {'inputs': inputs, 'outputs': previous.get('outputs', dict()) if unchanged else dict()}
+			if not unchanged:
+				self.changed.append(sample_id)
+				self._isolates[sample_id] = Isolate(sample)
+
+	@property
+	def samples(self) -> List[Isolate]:
+		""" All isolates in the set. Isolates skipped by an incremental run are parsed on first access."""
+		return [self.get_isolate(sample_id) for sample_id in self.isolate_paths]
+
+	def get_isolate(self, sample_id: str) -> Isolate:
+		if sample_id not in self._isolates:
+			self._isolates[sample_id] = Isolate(self.isolate_paths[sample_id])
+		return self._isolates[sample_id]
+
+	def load_manifest(self) -> Dict[str, Dict]:
+		if self.manifest_path.exists():
+			with self.manifest_path.open('r') as file1:
+				data = json.load(file1)
+			if 'isolates' in data:
+				return data
+		return dict()
 
-	def combineIsolateTables(self):
+	def save_manifest(self) -> Path:
+		with self.manifest_path.open('w') as file1:
+			json.dump({'isolates': self.manifest, 'combined': self.combined}, file1, indent = 4, sort_keys = True)
+		return self.manifest_path
 
-		tables = list()
-		for sample in self.samples:
-			df = pandas.read_table(sample.output_folder / "output_table.tsv", sep = "\t")
-			tables.append(df)
+	def input_state(self, sample_id: str) -> str:
+		""" A digest of the md5 of every input file of an isolate."""
+		inputs = self.manifest[sample_id]['inputs']
+		return hashlib.md5("\n".join("{}={}".format(key, inputs[key]['md5']) for key in sorted(inputs)).encode()).hexdigest()
 
-		df = pandas.concat(tables)
-		output_filename = self.output_folder / "isolate_set_combined_table.tsv"
-		df.to_csv(output_filename, sep = "\t")
+	def _update_output_tables(self, compression: Optional[str] = None, level: Optional[int] = None,
+			chunk_size: int = DEFAULT_CHUNK_SIZE):
+		""" Generates the output table of every new or changed isolate and records it in the manifest."""
+		for sample_id in self.changed:
+			isolate = self.get_isolate(sample_id)
+			if isolate.output_table is None:
+				isolate.generate_output_table(None, compression, level, chunk_size)
+			self.manifest[sample_id]['outputs']['table'] = str(isolate.output_table_path)
+
+	def combineIsolateTables(self, partitioned: bool = False, compression: Optional[str] = None,
+			level: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Path:
+		"""
+			Combines the output tables of every isolate. Tables already held in memory by each Isolate are used directly,
+			and each table is written out as soon as it is available so the combined table is never held in memory.
+			Only new or changed isolates are regenerated; the outputs of the others are reused.
+		Parameters
+		----------
+		partitioned: bool
+			If True, writes a parquet dataset partitioned by sample (`<folder>/sample=<sample_id>/part-0.parquet`)
+			instead of a single tsv file. The column types are preserved.
+		compression: {'gzip', 'zstd', None}
+			Compresses the tsv file (and the tables of new isolates) in a background thread. Ignored for parquet datasets.
+		level: int
+			The compression level.
+		chunk_size: int
+			The number of rows serialized at a time.
+
+		Returns
+		-------
+			The path to the combined table or the dataset folder.
+		"""
+		self._update_output_tables(None if partitioned else compression, level, chunk_size)
+		if partitioned:
+			output_filename = self.output_folder / "isolate_set_combined_table"
+			if not output_filename.exists():
+				output_filename.mkdir()
+			written = self.combined.setdefault(output_filename.name, dict())
+			partitions = {"sample={}".format(sample_id) for sample_id in self.isolate_paths}
+			for partition in output_filename.iterdir():
+				# Partitions of isolates that were removed from the set.
+				if partition.name.startswith('sample=') and partition.name not in partitions:
+					shutil.rmtree(str(partition), ignore_errors = True)
+					written.pop(partition.name[len('sample='):], None)
+			for sample_id in self.isolate_paths:
+				partition = output_filename / "sample={}".format(sample_id)
+				part = partition / "part-0.parquet"
+				state = self.input_state(sample_id)
+				if written.get(sample_id) == state and part.exists():
+					continue
+				if not partition.exists():
+					partition.mkdir()
+				df = self.get_isolate(sample_id).get_output_table()
+				with profiling.span('isolate_set.write_sample', sample_id) as stage:
+					df.drop(columns = ['sample']).to_parquet(part, index = False)
+					stage.count(len(df))
+				written[sample_id] = state
+		else:
+			output_filename = compressed_path(self.output_folder / "isolate_set_combined_table.tsv", compression)
+			states = {sample_id: self.input_state(sample_id) for sample_id in self.isolate_paths}
+			if self.combined.get(output_filename.name) != states or not output_filename.exists():
+				# Recorded as stale while it is rewritten, in case the run is interrupted.
+				self.combined.pop(output_filename.name, None)
+				self.save_manifest()
+				with CompressedWriter(output_filename, compression, level) as output:
+					for index, sample_id in enumerate(self.isolate_paths):
+						if sample_id in self.changed:
+							df = self.get_isolate(sample_id).get_output_table()
+							with profiling.span('isolate_set.write_sample', sample_id) as stage:
+								write_table_chunks(df, output, "\t", chunk_size, header = index == 0)
+								stage.count(len(df))
+						else:
+							# Copy the saved table directly rather than parsing it.
+							with profiling.span('isolate_set.copy_sample', sample_id):
+								with open_table(Path(self.manifest[sample_id]['outputs']['table'])) as table:
+									header = table.readline()
+									if index == 0:
+										output.write(header)
+									shutil.copyfileobj(table, output)
+				self.combined[output_filename.name] = states
+		self.save_manifest()
+		self.changed = list()
+		return output_filename
+
+	def get_mutation_matrix(self) -> MutationMatrix:
+		""" Builds a sparse isolate x mutation matrix from the annotated GenomeDiff of every isolate."""
+		return MutationMatrix({sample.sample_id: sample.output_gd_annotated for sample in self.samples})
+
+	def mergeGenomeDiffs(self, filetype: str = 'gd') -> Path:
+		"""
+			Streams the annotated GenomeDiff of every isolate into a single comparison file. The isolates are not parsed.
+		Parameters
+		----------
+		filetype: {'gd', 'tsv'}
+		"""
+		sources = {
+			sample_id: Isolate.input_files(path)['output_gd_annotated']
+			for sample_id, path in self.isolate_paths.items()
+		}
+		output_filename = self.output_folder / "isolate_set_merged.{}".format(filetype)
+		merge_genome_diffs(sources, output_filename, filetype)
 		return output_filename
 
+	def get_frequency_matrix(self, order: Dict[str, float] = None) -> FrequencyMatrix:
+		"""
+			Builds a mutation x sample allele frequency matrix from the annotated GenomeDiff of every isolate.
+		Parameters
+		----------
+		order: Dict[str, float]
+			Optional mapping of sample id to a sortable value (ex. timepoint) used to order the samples.
+		"""
+		return FrequencyMatrix.from_genome_diffs({sample.sample_id: sample.output_gd_annotated for sample in self.samples}, order)
+
+
+def main(argv: List[str] = None):
+	parser = argparse.ArgumentParser(description = "Combines the mutation tables of a folder of breseq output folders.")
+	parser.add_argument('path', help = "The folder containing the breseq output folders.")
+	parser.add_argument(
+		'--partitioned',
+		action = "store_true",
+		help = "Save the combined table as a parquet dataset partitioned by sample instead of a single tsv file.",
+		dest = 'partitioned'
+	)
+	parser.add_argument(
+		'--merge',
+		action = "store",
+		choices = ['gd', 'tsv'],
+		help = "Also merge the annotated GenomeDiff files of every isolate into a single comparison file.",
+		dest = 'merge'
+	)
+	parser.add_argument(
+		'--full',
+		action = "store_true",
+		help = "Reparse every isolate instead of only the isolates that changed since the last run.",
+		dest = 'full'
+	)
+	add_output_arguments(parser, "combined tsv file and the tables of new isolates")
+	profiling.add_profile_argument(parser)
+	args = parser.parse_args(argv)
+
+	if args.profile:
+		profiling.enable()
+	isolate_set = IsolateSet(Path(args.path), incremental = not args.full)
+	output_filename = isolate_set.combineIsolateTables(args.partitioned, args.compression, args.compression_level, args.chunk_size)
+	print("Saved the combined table to", output_filename)
+	if args.merge:
+		print("Saved the merged GenomeDiff to", isolate_set.mergeGenomeDiffs(args.merge))
+	if args.profile:
+		print("Saved the profile to", profiling.save_report(Path(args.profile)))
+
 
 if __name__ == "__main__":
-	path = Path("/home/cld100/projects/moreira_por/output/P148")
-	isolate_set = IsolateSet(path)
-	isolate_set.combineIsolateTables()
+	main()
@@ -0,0 +1,90 @@
+from typing import List, Dict, Tuple
+import numpy
+import pandas
+from scipy import sparse
+
+try:
+	from .genome_diff_parser import GenomeDiff, Mutation
+except:
+	from genome_diff_parser import GenomeDiff, Mutation
+
+MutationKey = Tuple[str, int, str, str]
+
+
+def mutation_key(mutation: Mutation) -> MutationKey:
+	""" The key used to identify the same mutation across isolates."""
+	return mutation.seq_id, mutation.position, mutation.type, mutation.new_seq
+
+
+class MutationMatrix:
+	"""
+		A sparse boolean isolate x mutation matrix.
+	Parameters
+	----------
+	samples: Dict[str, GenomeDiff]
+		Maps each sample id to its annotated GenomeDiff.
+	"""
+
+	def __init__(self, samples: Dict[str, GenomeDiff]):
+		self.samples: List[str] = list(samples.keys())
+		column_map: Dict[MutationKey, int] = dict()
+		rows = list()
+		columns = list()
+		for row_index, gd in enumerate(samples.values()):
+			for mutation in gd.mutations:
+				key = mutation_key(mutation)
+				rows.append(row_index)
+				columns.append(column_map.setdefault(key, len(column_map)))
+
+		self.mutations: List[MutationKey] = list(column_map.keys())
+		data = numpy.ones(len(rows), dtype = bool)
+		shape = (len(self.samples), len(self.mutations))
+		matrix = sparse.coo_matrix((data, (rows, columns)), shape = shape).tocsr()
+		# Duplicate entries are summed on conversion, so clip them back to booleans.
+		matrix.data[:] = True
+		self.matrix: sparse.csr_matrix = matrix
+
+	def _select_columns(self, mask: numpy.ndarray) -> List[MutationKey]:
+		return [self.mutations[i] for i in numpy.flatnonzero(mask)]
+
+	def sample_counts(self) -> numpy.ndarray:
+		""" The number of isolates carrying each mutation."""
+		return numpy.asarray(self.matrix.sum(axis = 0)).ravel()
+
+	def shared_by_all(self) -> List[MutationKey]:
+		""" Mutations present in every isolate."""
+		return self._select_columns(self.sample_counts() == len(self.samples))
+
+	def private(self) -> Dict[str, List[MutationKey]]:
+		""" Maps each sample to the mutations found only in that sample."""
+		columns = numpy.flatnonzero(self.sample_counts() == 1)
+		owners = self.matrix.tocsc()[:, columns].tocoo()
+		result = {sample: list() for sample in self.samples}
+		for row, column in zip(owners.row, owners.col):
+			result[self.samples[row]].append(self.mutations[columns[column]])
+		return result
+
+	def _intersections(self) -> Tuple[numpy.ndarray, numpy.ndarray]:
+		m = self.matrix.astype(numpy.int32)
+		intersection = (m @ m.T).toarray()
+		sizes = numpy.diag(intersection)
+		return intersection, sizes
+
+	def distance_matrix(self) -> pandas.DataFrame:
+		""" Pairwise number of mutations that differ between isolates (the size of the symmetric difference)."""
+		intersection, sizes = self._intersections()
+		distance = sizes[:, None] + sizes[None, :] - 2 * intersection
+		return pandas.DataFrame(distance, index = self.samples, columns = self.samples)
+
+	def jaccard(self) -> pandas.DataFrame:
+		""" Pairwise Jaccard similarity between the mutation sets of each isolate."""
+		intersection, sizes = self._intersections()
+		union = sizes[:, None] + sizes[None, :] - intersection
+		with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+			similarity = numpy.where(union > 0, intersection / union, 1.0)
+		return pandas.DataFrame(similarity, index = self.samples, columns = self.samples)
+
+	def to_frame(self) -> pandas.DataFrame:
+		""" A sparse DataFrame view of the matrix with a (seq_id, position, type, new_seq) column index."""
+		columns = pandas.MultiIndex.from_tuples(self.mutations, names = ['seq_id', 'position', 'type', 'new_seq'])
+		return pandas.DataFrame.sparse.from_spmatrix(self.matrix, index = self.samples, columns = columns)
@@ -0,0 +1,164 @@
+"""
+	Timing and memory spans around the stages of the breseq parsers.
+
+	Profiling is disabled by default, in which case `span()` returns a shared object that does nothing. Once enabled,
+	each span records its wall time, CPU time, peak allocated memory (via tracemalloc) and the number of items it
+	processed. Spans without a sample use the sample of the span they are nested in.
+
+	Usage:
+		with span('isolate.load_reference', sample_id) as stage:
+			records = load()
+			stage.count(len(records))
+"""
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+import argparse
+import json
+import time
+import tracemalloc
+
+
+class _DisabledSpan:
+	""" Used in place of a Span while profiling is disabled."""
+	__slots__ = ()
+
+	def __enter__(self) -> '_DisabledSpan':
+		return self
+
+	def __exit__(self, *exception):
+		return False
+
+	def count(self, items: int):
+		pass
+
+
+_DISABLED_SPAN = _DisabledSpan()
+
+
+class Span:
+	__slots__ = ('profiler', 'name', 'sample', 'items', 'wall', 'cpu', 'peak', '_start', '_start_cpu', '_start_memory', '_peak')
+
+	def __init__(self, profiler: 'Profiler', name: str, sample: Optional[str] = None, items: int = 0):
+		self.profiler = profiler
+		self.name = name
+		self.sample = sample
+		self.items = items
+		self.wall = 0.0
+		self.cpu = 0.0
+		self.peak = 0
+
+	def count(self, items: int):
+		""" Adds to the number of items (rows, mutations, files...) processed by this stage."""
+		self.items += items
+
+	def __enter__(self) -> 'Span':
+		stack = self.profiler.stack
+		current, peak = tracemalloc.get_traced_memory()
+		if stack:
+			parent = stack[-1]
+			parent._peak = max(parent._peak, peak)
+			if self.sample is None:
+				self.sample = parent.sample
+		tracemalloc.reset_peak()
+		self._start_memory = current
+		self._peak = current
+		stack.append(self)
+		self._start_cpu = time.process_time()
+		self._start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exception):
+		self.wall = time.perf_counter() - self._start
+		self.cpu = time.process_time() - self._start_cpu
+		stack = self.profiler.stack
+		stack.pop()
+		peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+		self.peak = peak - self._start_memory
+		tracemalloc.reset_peak()
+		if stack:
+			stack[-1]._peak = max(stack[-1]._peak, peak)
+		self.profiler.spans.append(self)
+		return False
+
+
+class Profiler:
+	"""
+		Collects the spans of a run. Spans are expected to be opened and closed from a single thread.
+	"""
+
+	def __init__(self):
+		self.enabled = False
+		self.spans: List[Span] = list()
+		self.stack: List[Span] = list()
+		self._started_tracemalloc = False
+
+	def enable(self):
+		self.enabled = True
+		if not tracemalloc.is_tracing():
+			tracemalloc.start()
+			self._started_tracemalloc = True
+
+	def disable(self):
+		self.enabled = False
+		if self._started_tracemalloc:
+			tracemalloc.stop()
+			self._started_tracemalloc = False
+
+	def span(self, name: str, sample: Optional[str] = None, items: int = 0) -> Union[Span, _DisabledSpan]:
+		if not self.enabled:
+			return _DISABLED_SPAN
+		return Span(self, name, sample, items)
+
+	@staticmethod
+	def _aggregate(spans: List[Span]) -> Dict[str, Dict[str, Union[int, float]]]:
+		stages = dict()
+		for span in spans:
+			stage = stages.setdefault(span.name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak_memory': 0, 'items': 0})
+			stage['calls'] += 1
+			stage['wall'] += span.wall
+			stage['cpu'] += span.cpu
+			stage['peak_memory'] = max(stage['peak_memory'], span.peak)
+			stage['items'] += span.items
+		return stages
+
+	def report(self) -> Dict[str, Dict]:
+		""" Aggregates the spans by stage, both in total and for each sample. Times are in seconds, memory in bytes."""
+		samples = dict()
+		for span in self.spans:
+			if span.sample is not None:
+				samples.setdefault(span.sample, list()).append(span)
+		return {
+			'total':   self._aggregate(self.spans),
+			'samples': {sample: self._aggregate(spans) for sample, spans in samples.items()}
+		}
+
+	def save(self, path: Path) -> Path:
+		with path.open('w') as file1:
+			json.dump(self.report(), file1, indent = 4)
+		return path
+
+
+PROFILER = Profiler()
+
+
+def span(name: str, sample: Optional[str] = None, items: int = 0) -> Union[Span, _DisabledSpan]:
+	""" Opens a span on the shared profiler. Does nothing unless `enable()` was called."""
+	return PROFILER.span(name, sample, items)
+
+
+def enable():
+	PROFILER.enable()
+
+
+def save_report(path: Path) -> Path:
+	return PROFILER.save(path)
+
+
+def add_profile_argument(parser: argparse.ArgumentParser):
+	""" Adds the --profile option, which enables profiling and names the file the report is saved to."""
+	parser.add_argument(
+		'--profile',
+		action = "store",
+		help = "Save the time and memory used by each stage, per sample and in total, to this json file.",
+		dest = 'profile'
+	)
@@ -0,0 +1,179 @@
+"""
+	Writes tables as gzip or zstd compressed text in fixed-size row chunks. Each chunk is serialized in the calling
+	thread while the previous chunk is compressed and written in a worker thread.
+"""
+from pathlib import Path
+from typing import Optional, TextIO, Union
+import argparse
+import io
+import gzip
+import queue
+import threading
+import zlib
+
+import pandas
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+COMPRESSION_SUFFIXES = {
+	'gzip': '.gz',
+	'zstd': '.zst'
+}
+DEFAULT_CHUNK_SIZE = 100000
+
+
+def compressed_path(path: Path, compression: Optional[str]) -> Path:
+	""" Adds the suffix of `compression` to `path`, if it is not already there."""
+	if compression is None:
+		return path
+	suffix = COMPRESSION_SUFFIXES[compression]
+	return path if path.suffix == suffix else path.with_name(path.name + suffix)
+
+
+def open_table(path: Path) -> TextIO:
+	""" Opens a plain, gzip or zstd compressed text file for reading, based on its suffix."""
+	if path.suffix == '.gz':
+		return gzip.open(str(path), 'rt')
+	if path.suffix == '.zst':
+		if zstandard is None:
+			raise ImportError("Reading '{}' requires the 'zstandard' package.".format(path))
+		return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(path.open('rb')))
+	return path.open('r')
+
+
+class CompressedWriter(threading.Thread):
+	"""
+		A text file that is compressed and written in a worker thread. Text is passed in with `write()`, so the
+		writer can be used wherever pandas expects a file handle.
+	Parameters
+	----------
+	path: Path
+		The output file. The suffix is not changed; see `compressed_path()`.
+	compression: {'gzip', 'zstd', None}
+	level: int
+		The compression level. Defaults to 6 for gzip and 3 for zstd.
+	"""
+
+	def __init__(self, path: Path, compression: Optional[str] = 'gzip', level: Optional[int] = None):
+		super().__init__(daemon = True)
+		if compression not in (None, 'gzip', 'zstd'):
+			raise ValueError("Unsupported compression: '{}'".format(compression))
+		if compression == 'zstd' and zstandard is None:
+			raise ImportError("zstd compression requires the 'zstandard' package.")
+		self.path = path
+		self.compression = compression
+		self.level = level
+		self.chunks = queue.Queue(maxsize = 4)
+		self.error: Optional[BaseException] = None
+		self._file = path.open('wb')
+		self.start()
+
+	def _compressor(self):
+		if self.compression == 'gzip':
+			level = 6 if self.level is None else self.level
+			return zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+		if self.compression == 'zstd':
+			level = 3 if self.level is None else self.level
+			return zstandard.ZstdCompressor(level = level).compressobj()
+		return None
+
+	def write(self, text: str) -> int:
+		if self.error is not None:
+			raise self.error
+		self.chunks.put(text.encode('utf-8'))
+		return len(text)
+
+	def close(self):
+		""" Waits for the remaining chunks to be compressed and closes the file."""
+		if self._file.closed:
+			return
+		self.chunks.put(None)
+		self.join()
+		self._file.close()
+		if self.error is not None:
+			raise self.error
+
+	def run(self):
+		compressor = self._compressor()
+		try:
+			for chunk in iter(self.chunks.get, None):
+				self._file.write(compressor.compress(chunk) if compressor else chunk)
+			if compressor:
+				self._file.write(compressor.flush())
+		except BaseException as exception:
+			self.error = exception
+			# Keep consuming so that write() never blocks on a full queue.
+			for _ in iter(self.chunks.get, None):
+				pass
+
+	def __enter__(self) -> 'CompressedWriter':
+		return self
+
+	def __exit__(self, *exception):
+		self.close()
+		return False
+
+
+def write_table_chunks(table: pandas.DataFrame, output: Union[TextIO, CompressedWriter], sep: str = '\t',
+		chunk_size: int = DEFAULT_CHUNK_SIZE, header: bool = True) -> int:
+	""" Writes a table to an open file `chunk_size` rows at a time. Returns the number of rows written."""
+	if header:
+		output.write(table.iloc[:0].to_csv(sep = sep, index = False, header = header))
+	for start in range(0, len(table), chunk_size):
+		output.write(table.iloc[start:start + chunk_size].to_csv(sep = sep, index = False, header = False))
+	return len(table)
+
+
+def write_table(table: pandas.DataFrame, path: Path, sep: str = '\t', compression: Optional[str] = None,
+		level: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Path:
+	"""
+		Saves a table as delimited text, optionally compressed.
+	Parameters
+	----------
+	table: pandas.DataFrame
+	path: Path
+		The output file. The suffix of the compression ('.gz', '.zst') is added if missing.
+	sep: str
+	compression: {'gzip', 'zstd', None}
+	level: int
+		The compression level.
+	chunk_size: int
+		The number of rows serialized at a time.
+
+	Returns
+	-------
+		The path to the saved file.
+	"""
+	path = compressed_path(path, compression)
+	with CompressedWriter(path, compression, level) as output:
+		write_table_chunks(table, output, sep, chunk_size)
+	return path
+
+
+def add_output_arguments(parser: argparse.ArgumentParser, outputs: str = "output tables"):
+	""" Adds the --compression, --compression-level and --chunk-size options used by the table writers to a parser."""
+	parser.add_argument(
+		'--compression',
+		action = "store",
+		choices = list(COMPRESSION_SUFFIXES.keys()),
+		help = "Compress the {}. zstd requires the 'zstandard' package.".format(outputs),
+		dest = 'compression'
+	)
+	parser.add_argument(
+		'--compression-level',
+		action = "store",
+		type = int,
+		help = "The compression level. Defaults to 6 for gzip and 3 for zstd.",
+		dest = 'compression_level'
+	)
+	parser.add_argument(
+		'--chunk-size',
+		action = "store",
+		type = int,
+		default = DEFAULT_CHUNK_SIZE,
+		help = "The number of rows written at a time. Defaults to {}.".format(DEFAULT_CHUNK_SIZE),
+		dest = 'chunk_size'
+	)
@@ -1 +1,2 @@
-from .ncbi_report import *
\ No newline at end of file
+from .ncbi_report import *
+from .ncbi_catalog import NCBIReportCatalog, load_reports
\ No newline at end of file
@@ -0,0 +1,183 @@
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+from dataclasses import fields, astuple
+from typing import List, Iterable, Optional, Tuple
+import sqlite3
+import pendulum
+
+try:
+	from .ncbi_report import NCBIReport, AssemblyReportMetadata
+except:
+	from ncbi_report import NCBIReport, AssemblyReportMetadata
+
+METADATA_COLUMNS = [f.name for f in fields(AssemblyReportMetadata)]
+SUMMARY_COLUMNS = ['sequence_count', 'total_length', 'n50']
+CATALOG_COLUMNS = ['path', 'mtime', 'sample_id'] + METADATA_COLUMNS + SUMMARY_COLUMNS
+COLUMN_TYPES = {'path': 'TEXT PRIMARY KEY', 'mtime': 'REAL', **{column: 'INTEGER' for column in SUMMARY_COLUMNS}}
+INDEXED_COLUMNS = ['sample_id', 'genebank_assembly_extension', 'refseq_assembly_accession', 'taxonomic_id', 'organism_name']
+
+
+def _parse_report(path: str) -> Tuple:
+	""" Parses a single report into a catalog row. Defined at the module level so it can be sent to worker processes."""
+	filename = Path(path)
+	mtime = filename.stat().st_mtime
+	report = NCBIReport(filename)
+	row = list(astuple(report.metadata))
+	date_index = METADATA_COLUMNS.index('date')
+	if row[date_index] is not None:
+		row[date_index] = row[date_index].to_date_string()
+	sequences = report.sequences
+	return (path, mtime, report.sample_id, *row, len(sequences), sequences.total_length(), sequences.n50())
+
+
+class NCBIReportCatalog:
+	"""
+		A local sqlite catalog of the metadata of many NCBI assembly reports. Reports are only re-parsed when their
+		mtime changes, and lookups by accession, taxid and organism use indexes.
+	Parameters
+	----------
+	path: Path
+		The catalog database file. Created if it does not exist.
+	"""
+
+	def __init__(self, path: Path):
+		self.path = path
+		self.connection = sqlite3.connect(str(path))
+		column_definitions = ", ".join(
+			"{} {}".format(column, COLUMN_TYPES.get(column, 'TEXT'))
+			for column in CATALOG_COLUMNS
+		)
+		self.connection.execute("CREATE TABLE IF NOT EXISTS reports ({})".format(column_definitions))
+		for column in INDEXED_COLUMNS:
+			self.connection.execute("CREATE INDEX IF NOT EXISTS idx_{0} ON reports ({0})".format(column))
+		self.connection.commit()
+
+	def update(self, paths: Iterable[Path], processes: Optional[int] = None, folders: Iterable[Path] = ()) -> int:
+		"""
+			Parses every new or modified report across a process pool and saves it to the catalog.
+		Parameters
+		----------
+		paths: Iterable[Path]
+			The assembly report files.
+		processes: int
+			The number of worker processes. Defaults to the number of cpus.
+		folders: Iterable[Path]
+			The folders `paths` were found in. Reports in these folders that no longer exist are removed from the catalog.
+
+		Returns
+		-------
+			The number of reports that were parsed.
+		"""
+		known = dict(self.connection.execute("SELECT path, mtime FROM reports"))
+		pending = list()
+		for path in paths:
+			path = str(Path(path).absolute())
+			if known.get(path) != Path(path).stat().st_mtime:
+				pending.append(path)
+
+		if pending:
+			with ProcessPoolExecutor(max_workers = processes) as executor:
+				rows = list(executor.map(_parse_report, pending, chunksize = max(1, len(pending) // 64)))
+			placeholders = ", ".join("?" for _ in CATALOG_COLUMNS)
+			self.connection.executemany("INSERT OR REPLACE INTO reports VALUES ({})".format(placeholders), rows)
+			self.connection.commit()
+		self.remove_missing(folders)
+		return len(pending)
+
+	def remove_missing(self, folders: Iterable[Path]) -> int:
+		""" Removes the reports within `folders` whose files were deleted or moved. Returns the number of removed reports."""
+		folders = [Path(folder).absolute() for folder in folders]
+		if not folders:
+			return 0
+		missing = [
+			(path,) for (path,) in self.connection.execute("SELECT path FROM reports")
+			if any(folder in Path(path).parents for folder in folders) and not Path(path).exists()
+		]
+		if missing:
+			self.connection.executemany("DELETE FROM reports WHERE path = ?", missing)
+			self.connection.commit()
+		return len(missing)
+
+	@staticmethod
+	def _to_metadata(row: Tuple) -> AssemblyReportMetadata:
+		values = list(row[3:3 + len(METADATA_COLUMNS)])
+		date_index = METADATA_COLUMNS.index('date')
+		if values[date_index]:
+			values[date_index] = pendulum.parse(values[date_index])
+		identical_index = METADATA_COLUMNS.index('refseq_and_genebank_asseblies_identical')
+		values[identical_index] = bool(int(values[identical_index]))
+		return AssemblyReportMetadata(*values)
+
+	def _select(self, column: str, value: str) -> List[AssemblyReportMetadata]:
+		rows = self.connection.execute("SELECT * FROM reports WHERE {} = ?".format(column), (value,))
+		return [self._to_metadata(row) for row in rows]
+
+	def get_by_accession(self, accession: str) -> List[AssemblyReportMetadata]:
+		""" Matches either the GenBank or RefSeq assembly accession."""
+		return self._select('refseq_assembly_accession', accession) + self._select('genebank_assembly_extension', accession)
+
+	def get_all(self) -> List[AssemblyReportMetadata]:
+		return [self._to_metadata(row) for row in self.connection.execute("SELECT * FROM reports")]
+
+	def get_by_taxid(self, taxid: str) -> List[AssemblyReportMetadata]:
+		return self._select('taxonomic_id', str(taxid))
+
+	def get_by_organism(self, organism: str) -> List[AssemblyReportMetadata]:
+		return self._select('organism_name', organism)
+
+	def to_table(self):
+		""" Returns the catalog as a typed pandas.DataFrame."""
+		import pandas
+		df = pandas.read_sql_query("SELECT * FROM reports", self.connection)
+		df['date'] = pandas.to_datetime(df['date'])
+		df['refseq_and_genebank_asseblies_identical'] = df['refseq_and_genebank_asseblies_identical'].astype(int).astype(bool)
+		for column in ['assembly_level', 'assembly_type', 'release_type', 'genome_representation', 'taxonomic_id']:
+			df[column] = df[column].astype('category')
+		return df
+
+	def close(self):
+		self.connection.close()
+
+
+def load_reports(paths: Iterable[Path], processes: Optional[int] = None) -> List[NCBIReport]:
+	""" Parses many assembly reports across a process pool."""
+	paths = list(paths)
+	with ProcessPoolExecutor(max_workers = processes) as executor:
+		return list(executor.map(NCBIReport, paths, chunksize = max(1, len(paths) // 64)))
+
+
+def main(argv: List[str] = None):
+	parser = argparse.ArgumentParser(description = "Builds or updates a catalog of NCBI assembly reports.")
+	parser.add_argument('catalog', help = "The catalog database file.")
+	parser.add_argument('folders', nargs = '*', help = "Folders to search for '*/*_assembly_report.txt' files.")
+	parser.add_argument(
+		'-p', '--processes',
+		action = "store",
+		type = int,
+		help = "The number of worker processes. Defaults to the number of cpus.",
+		dest = 'processes'
+	)
+	parser.add_argument('--accession', action = "store", help = "Print the reports matching an assembly accession.")
+	parser.add_argument('--taxid', action = "store", help = "Print the reports matching a taxid.")
+	parser.add_argument('--organism', action = "store", help = "Print the reports matching an organism name.")
+	args = parser.parse_args(argv)
+
+	catalog = NCBIReportCatalog(Path(args.catalog))
+	paths = [path for folder in args.folders for path in Path(folder).glob("*/*_assembly_report.txt")]
+	if args.folders:
+		print("Parsed {} new or modified reports.".format(catalog.update(paths, args.processes, args.folders)))
+	results = list()
+	if args.accession:
+		results += catalog.get_by_accession(args.accession)
+	if args.taxid:
+		results += catalog.get_by_taxid(args.taxid)
+	if args.organism:
+		results += catalog.get_by_organism(args.organism)
+	for result in results:
+		print(result)
+	catalog.close()
+
+
+if __name__ == "__main__":
+	main()
@@ -1,8 +1,22 @@
 from pathlib import Path
 from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import hashlib
+import json
+import time
+import zlib
 import pendulum
 import re
-from typing import List, Union
+import numpy
+from typing import List, Union, Dict, Optional, Tuple
+
+SEQUENCE_TABLE_COLUMNS = [
+	'Sequence-Name', 'Sequence-Role', 'Assigned-Molecule', 'Assigned-Molecule-Location/Type', 'GenBank-Accn',
+	'Relationship', 'RefSeq-Accn', 'Assembly-Unit', 'Sequence-Length', 'UCSC-style-name'
+]
+# Columns that identify a sequence and can be used to look it up.
+SEQUENCE_KEY_COLUMNS = ['Sequence-Name', 'GenBank-Accn', 'RefSeq-Accn', 'UCSC-style-name']
 
 
 @dataclass
@@ -92,6 +106,81 @@ class AssemblyReportMetadata:
 		return cls(*metadata)
 
 
+@dataclass
+class UnpackResult:
+	source: Path
+	output: Path
+	compressed_bytes: int
+	uncompressed_bytes: int
+	md5: str
+	expected_md5: Optional[str]
+	seconds: float
+	error: Optional[str] = None
+
+	@property
+	def verified(self) -> bool:
+		return self.error is None and self.expected_md5 is not None and self.md5 == self.expected_md5
+
+	@property
+	def failed(self) -> bool:
+		return self.error is not None or (self.expected_md5 is not None and self.md5 != self.expected_md5)
+
+
+def _unpack_file(source: Path, output: Path, expected_md5: Optional[str], chunk_size: int = 4 * 1024 * 1024) -> UnpackResult:
+	"""
+		Decompresses a .gz file while computing its md5 in the same pass. The output is written to a temporary file
+		and only renamed once the checksum matches. Files without a checksum are unpacked but not verified. Corrupt or
+		truncated gzip data is reported in the `error` of the result rather than raised, so one bad download does not
+		stop a batch.
+	"""
+	start = time.perf_counter()
+	md5 = hashlib.md5()
+	temporary = output.with_name(output.name + '.partial')
+	compressed_bytes = uncompressed_bytes = 0
+	error = None
+	decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+	try:
+		with source.open('rb') as input_file, temporary.open('wb') as output_file:
+			for chunk in iter(lambda: input_file.read(chunk_size), b''):
+				compressed_bytes += len(chunk)
+				md5.update(chunk)
+				if error is not None:
+					# Keep hashing so the reported md5 is that of the whole file.
+					continue
+				try:
+					while chunk:
+						data = decompressor.decompress(chunk)
+						uncompressed_bytes += len(data)
+						output_file.write(data)
+						# A .gz file may contain several concatenated gzip members.
+						chunk = decompressor.unused_data
+						if chunk:
+							decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+				except zlib.error as exception:
+					error = "Invalid gzip data: {}".format(exception)
+			if error is None:
+				data = decompressor.flush()
+				uncompressed_bytes += len(data)
+				output_file.write(data)
+				if not decompressor.eof:
+					error = "Truncated gzip data"
+	except OSError as exception:
+		error = str(exception)
+
+	if error is None and (expected_md5 is None or md5.hexdigest() == expected_md5):
+		temporary.replace(output)
+	else:
+		if temporary.exists():
+			temporary.unlink()
+		if error is not None:
+			print("Could not unpack '{}': {}".format(source, error))
+		else:
+			print("Checksum mismatch for '{}': expected {}, got {}".format(source, expected_md5, md5.hexdigest()))
+	return UnpackResult(
+		source, output, compressed_bytes, uncompressed_bytes, md5.hexdigest(), expected_md5, time.perf_counter() - start,
+		error)
+
+
 class NCBIPackage:
 	"""
 	Parameters
@@ -102,10 +191,10 @@ class NCBIPackage:
 
 	def __init__(self, path: Path):
 		assert path.is_dir()
+		self.path = path
 		self.genome_id = path.name
-		print(repr(self.genome_id))
-
-		print([i.name.replace(self.genome_id, '') for i in path.iterdir()])
+		self.checksum_file = path / 'md5checksums.txt'
+		self.unpacked_file = path / 'unpacked.json'
 
 	suffixes = [
 		'annotation_hashes.txt', 'assembly_status.txt', '_assembly_report.txt', '_assembly_stats.txt',
@@ -114,8 +203,174 @@ class NCBIPackage:
 		'_translated_cds.faa.gz', '_wgsmaster.gbff.gz', 'md5checksums.txt'
 	]
 
-	def unpack(self, key):
-		pass
+	def get_file(self, suffix: str) -> Path:
+		return self.path / (self.genome_id + suffix)
+
+	def read_checksums(self) -> Dict[str, str]:
+		""" Maps each filename listed in md5checksums.txt to its md5."""
+		checksums = dict()
+		if self.checksum_file.exists():
+			with self.checksum_file.open('r') as file1:
+				for line in file1:
+					line = line.split()
+					if len(line) == 2:
+						checksums[Path(line[1]).name] = line[0]
+		return checksums
+
+	def read_unpacked(self) -> Dict[str, Dict]:
+		if self.unpacked_file.exists():
+			with self.unpacked_file.open('r') as file1:
+				return json.load(file1)
+		return dict()
+
+	def tasks(self, keys: Optional[List[str]] = None) -> List[Tuple[Path, Path, Optional[str]]]:
+		"""
+			Lists the (source, output, md5) of every compressed file to unpack. Files that were already unpacked from a
+			source with the same md5 are excluded.
+		Parameters
+		----------
+		keys: List[str]
+			The suffixes to unpack (ex. '_genomic.fna.gz'). Defaults to every .gz suffix.
+		"""
+		if keys is None:
+			keys = [i for i in self.suffixes if i.endswith('.gz')]
+		elif isinstance(keys, str):
+			keys = [keys]
+		checksums = self.read_checksums()
+		unpacked = self.read_unpacked()
+		tasks = list()
+		for key in keys:
+			source = self.get_file(key)
+			if not source.exists():
+				continue
+			output = source.with_suffix('')
+			expected = checksums.get(source.name)
+			previous = unpacked.get(source.name, dict())
+			if expected and previous.get('md5') == expected and output.exists() and output.stat().st_size == previous.get('size'):
+				continue
+			tasks.append((source, output, expected))
+		return tasks
+
+	def record(self, results: List[UnpackResult]):
+		""" Saves the checksums of unpacked files so that they are skipped next time."""
+		unpacked = self.read_unpacked()
+		checksums = self.read_checksums()
+		for result in results:
+			if result.verified:
+				unpacked[result.source.name] = {'md5': checksums[result.source.name], 'size': result.uncompressed_bytes}
+		with self.unpacked_file.open('w') as file1:
+			json.dump(unpacked, file1, indent = 4, sort_keys = True)
+
+	def unpack(self, key: Union[str, List[str]] = None, threads: int = 4) -> List[UnpackResult]:
+		""" Verifies and decompresses the files matching the selected suffixes. See `unpack_packages()`."""
+		return unpack_packages([self], key, threads)
+
+
+def unpack_packages(packages: List[NCBIPackage], keys: Union[str, List[str]] = None, threads: int = 4) -> List[UnpackResult]:
+	"""
+		Verifies and decompresses the selected files of many packages on a single thread pool.
+	Parameters
+	----------
+	packages: List[NCBIPackage]
+	keys: List[str]
+		The suffixes to unpack. Defaults to every .gz suffix.
+	threads: int
+		The number of files processed at once.
+	"""
+	start = time.perf_counter()
+	jobs = [(package, task) for package in packages for task in package.tasks(keys)]
+	with ThreadPoolExecutor(max_workers = threads) as executor:
+		results = list(executor.map(lambda job: _unpack_file(*job[1]), jobs))
+
+	for package in packages:
+		package_results = [r for (p, _), r in zip(jobs, results) if p is package]
+		if package_results:
+			package.record(package_results)
+
+	failed = [i for i in results if i.failed]
+	if failed:
+		print("{} files failed verification.".format(len(failed)))
+	elapsed = time.perf_counter() - start
+	compressed = sum(i.compressed_bytes for i in results)
+	uncompressed = sum(i.uncompressed_bytes for i in results)
+	print("Unpacked {} files ({:.1f} MB -> {:.1f} MB) in {:.1f}s ({:.1f} MB/s)".format(
+		len(results) - len(failed), compressed / 1E6, uncompressed / 1E6, elapsed, compressed / 1E6 / max(elapsed, 1E-9)))
+	return results
+
+
+class AssemblySequenceTable:
+	"""
+		The sequence table of an assembly report, stored as one numpy array per column with a hash index from each
+		name and accession to its row.
+	Parameters
+	----------
+	header: List[str]
+		The column names.
+	lines: List[str]
+		The tab-delimited rows of the table.
+	"""
+
+	def __init__(self, header: List[str], lines: List[str]):
+		rows = [line.split('\t') for line in lines]
+		self.columns: Dict[str, numpy.ndarray] = dict()
+		for index, column in enumerate(header):
+			values = [row[index] if index < len(row) else '' for row in rows]
+			if column == 'Sequence-Length':
+				self.columns[column] = numpy.array([int(i) if i.isdigit() else 0 for i in values], dtype = numpy.int64)
+			else:
+				self.columns[column] = numpy.array(values, dtype = object)
+
+		self.index: Dict[str, int] = dict()
+		for column in SEQUENCE_KEY_COLUMNS:
+			for row, value in enumerate(self.columns.get(column, [])):
+				if value and value != 'na':
+					self.index.setdefault(value, row)
+
+	def __len__(self) -> int:
+		return len(self.lengths)
+
+	@property
+	def lengths(self) -> numpy.ndarray:
+		return self.columns.get('Sequence-Length', numpy.zeros(0, dtype = numpy.int64))
+
+	def get(self, key: str) -> Optional[Dict[str, Union[str, int]]]:
+		""" Returns the row matching a sequence name, GenBank accession, RefSeq accession or UCSC name."""
+		row = self.index.get(key)
+		if row is None:
+			return None
+		return {column: values[row] for column, values in self.columns.items()}
+
+	def translate(self, key: str, column: str = 'RefSeq-Accn') -> Optional[str]:
+		""" Translates any name or accession of a sequence to the value of `column`. ex. a GenomeDiff seq_id to its RefSeq accession."""
+		row = self.index.get(key)
+		return None if row is None else self.columns[column][row]
+
+	def total_length(self) -> int:
+		return int(self.lengths.sum())
+
+	def n50(self) -> int:
+		lengths = numpy.sort(self.lengths)[::-1]
+		if len(lengths) == 0:
+			return 0
+		cumulative = numpy.cumsum(lengths)
+		return int(lengths[numpy.searchsorted(cumulative, cumulative[-1] / 2)])
+
+	def replicon_counts(self) -> Dict[str, int]:
+		""" The number of assembled molecules of each type (ex. Chromosome, Plasmid)."""
+		roles = self.columns.get('Sequence-Role')
+		types = self.columns.get('Assigned-Molecule-Location/Type')
+		if roles is None or types is None:
+			return dict()
+		names, counts = numpy.unique(types[roles == 'assembled-molecule'].astype(str), return_counts = True)
+		return dict(zip(names.tolist(), counts.tolist()))
+
+	def summary(self) -> Dict[str, Union[int, Dict[str, int]]]:
+		return {
+			'sequences':       len(self),
+			'total_length':    self.total_length(),
+			'n50':             self.n50(),
+			'replicon_counts': self.replicon_counts()
+		}
 
 
 class NCBIReport:
@@ -129,6 +384,10 @@ class NCBIReport:
 
 		sequences = [i for i in contents if not i.startswith('#') and len(i) > 2]
 
+		header = [i for i in metadata if i.startswith('# Sequence-Name')]
+		header = header[-1][2:].strip().split('\t') if header else SEQUENCE_TABLE_COLUMNS
+		sequences = AssemblySequenceTable(header, sequences)
+
 		metadata = self.parse_metadata(metadata)
 
 		return metadata, sequences
@@ -146,8 +405,39 @@ class NCBIReport:
 		return metadata
 
 
-if __name__ == "__main__":
-	path = Path.home() / "Documents" / "projects" / "docusate" / "genome_assemblies" / "ncbi-genomes" / "GCF_002223045.1_ASM222304v1" / "GCF_002223045.1_ASM222304v1_assembly_report.txt"
-	report = NCBIReport(path)
+def main(argv: List[str] = None):
+	parser = argparse.ArgumentParser(description = "Reads NCBI assembly reports and verifies/unpacks NCBI genome packages.")
+	parser.add_argument('paths', nargs = '+', help = "Assembly report files, or genome package folders when using --unpack.")
+	parser.add_argument(
+		'--unpack',
+		action = "store_true",
+		help = "Verify and decompress the files of each genome package folder.",
+		dest = 'unpack'
+	)
+	parser.add_argument(
+		'-k', '--suffix',
+		action = "append",
+		help = "A file suffix to unpack (ex. '_genomic.fna.gz'). May be given more than once. Defaults to every .gz file.",
+		dest = 'suffixes'
+	)
+	parser.add_argument(
+		'-t', '--threads',
+		action = "store",
+		type = int,
+		default = 4,
+		help = "The number of files to unpack at once. Defaults to 4.",
+		dest = 'threads'
+	)
+	args = parser.parse_args(argv)
+
+	if args.unpack:
+		unpack_packages([NCBIPackage(Path(i)) for i in args.paths], args.suffixes, args.threads)
+	else:
+		for path in args.paths:
+			report = NCBIReport(Path(path))
+			print(report.metadata)
+			print(report.sequences.summary())
 
-	print(report.metadata)
\ No newline at end of file
+
+if __name__ == "__main__":
+	main()
@@ -1 +1,2 @@
-from . tree_labels import *
\ No newline at end of file
+from . tree_labels import *
+from . newick import Tree, parse_newick, read_newick
\ No newline at end of file
@@ -0,0 +1,286 @@
+from pathlib import Path
+from typing import List, Dict, Iterable, Optional, TextIO, Tuple, Union
+import io
+import numpy
+
+try:
+	from .tree_labels import _tokenize, NEWICK_DELIMITERS
+except:
+	from tree_labels import _tokenize, NEWICK_DELIMITERS
+
+
+def _edge_depths(parent: numpy.ndarray) -> numpy.ndarray:
+	""" The number of edges between each node and the root, computed by pointer jumping."""
+	depth = (parent >= 0).astype(numpy.int64)
+	ancestor = parent.copy()
+	while True:
+		mask = ancestor >= 0
+		if not mask.any():
+			break
+		depth[mask] += depth[ancestor[mask]]
+		ancestor[mask] = ancestor[ancestor[mask]]
+	return depth
+
+
+def _quote(label: str) -> str:
+	if any(i in NEWICK_DELIMITERS or i.isspace() or i == "'" for i in label):
+		return "'{}'".format(label.replace("'", "''"))
+	return label
+
+
+def _unquote(label: str) -> str:
+	if label.startswith("'") and label.endswith("'") and len(label) > 1:
+		return label[1:-1].replace("''", "'")
+	return label
+
+
+class Tree:
+	"""
+		A rooted tree stored as flat arrays. Nodes are numbered in preorder, so every node's parent has a lower index
+		and the subtree of node `v` is the contiguous range `v:v + size[v]`.
+	Parameters
+	----------
+	parent: numpy.ndarray
+		The index of each node's parent. The root has a parent of -1.
+	branch_length: numpy.ndarray
+		The length of the branch above each node. NaN if missing.
+	support: numpy.ndarray
+		The support value (ex. bootstrap) of each internal node. NaN if missing.
+	label_index: numpy.ndarray
+		The index of each node's label in `labels`, or -1 if unlabeled.
+	labels: List[str]
+		The interned label table.
+	"""
+
+	def __init__(self, parent: numpy.ndarray, branch_length: numpy.ndarray, support: numpy.ndarray,
+			label_index: numpy.ndarray, labels: List[str]):
+		self.parent = parent
+		self.branch_length = branch_length
+		self.support = support
+		self.label_index = label_index
+		self.labels = labels
+
+		self.depth = _edge_depths(parent)
+		order = numpy.argsort(self.depth, kind = 'stable')
+		boundaries = numpy.flatnonzero(numpy.diff(self.depth[order])) + 1
+		# The nodes at each depth, used to process the tree one level at a time.
+		self.levels: List[numpy.ndarray] = numpy.split(order, boundaries)
+
+		self.is_tip = numpy.ones(len(parent), dtype = bool)
+		self.is_tip[parent[parent >= 0]] = False
+		self.size = numpy.ones(len(parent), dtype = numpy.int64)
+		for level in reversed(self.levels[1:]):
+			numpy.add.at(self.size, parent[level], self.size[level])
+
+		self.label_map: Dict[str, int] = dict()
+		for node in numpy.flatnonzero(label_index >= 0):
+			self.label_map.setdefault(labels[label_index[node]], int(node))
+
+	def __len__(self) -> int:
+		return len(self.parent)
+
+	@property
+	def tips(self) -> numpy.ndarray:
+		return numpy.flatnonzero(self.is_tip)
+
+	def get_labels(self, nodes: Iterable[int]) -> List[Optional[str]]:
+		return [self.labels[i] if i >= 0 else None for i in self.label_index[numpy.asarray(nodes, dtype = numpy.int64)]]
+
+	def find(self, labels: Union[str, Iterable[str]]) -> Union[int, numpy.ndarray]:
+		""" Returns the node index of a label, or an array of indices for a list of labels."""
+		if isinstance(labels, str):
+			return self.label_map[labels]
+		return numpy.array([self.label_map[i] for i in labels], dtype = numpy.int64)
+
+	def subtree_tips(self, node: int) -> numpy.ndarray:
+		""" The tips under a node."""
+		return node + numpy.flatnonzero(self.is_tip[node:node + self.size[node]])
+
+	def mrca(self, nodes: Iterable[int]) -> int:
+		""" The most recent common ancestor of a set of nodes."""
+		nodes = numpy.asarray(nodes, dtype = numpy.int64)
+		first, last = nodes.min(), nodes.max()
+		node = first
+		while node + self.size[node] <= last:
+			node = self.parent[node]
+		return int(node)
+
+	def root_distances(self) -> numpy.ndarray:
+		""" The sum of branch lengths from the root to each node. Missing branch lengths count as 0."""
+		lengths = numpy.nan_to_num(self.branch_length)
+		distance = numpy.zeros(len(self), dtype = numpy.float64)
+		for level in self.levels[1:]:
+			distance[level] = distance[self.parent[level]] + lengths[level]
+		return distance
+
+	def cophenetic(self, tips: Iterable[int] = None) -> Tuple[List[str], numpy.ndarray]:
+		"""
+			The patristic distance between every pair of tips.
+		Parameters
+		----------
+		tips: Iterable[int]
+			The tips to include. Defaults to every tip. The result has len(tips)^2 entries.
+
+		Returns
+		-------
+			labels, distance_matrix
+		"""
+		tips = self.tips if tips is None else numpy.sort(numpy.asarray(tips, dtype = numpy.int64))
+		distance = self.root_distances()
+		# The root distance of the deepest shared ancestor of each pair. Since subtrees are contiguous, the tips of a
+		# child are a block of rows, and the pairs whose ancestor is the child's parent are those between the block and
+		# the blocks of the later siblings, which end where the parent's subtree ends. Each pair is written once.
+		shared = numpy.zeros((len(tips), len(tips)), dtype = numpy.float64)
+		nodes = numpy.flatnonzero(self.parent >= 0)
+		parents = self.parent[nodes]
+		starts = numpy.searchsorted(tips, nodes)
+		ends = numpy.searchsorted(tips, nodes + self.size[nodes])
+		parent_ends = numpy.searchsorted(tips, parents + self.size[parents])
+		selected = (ends > starts) & (parent_ends > ends)
+		for parent, start, end, parent_end in zip(parents[selected], starts[selected], ends[selected], parent_ends[selected]):
+			shared[start:end, end:parent_end] = distance[parent]
+			shared[end:parent_end, start:end] = distance[parent]
+		tip_distance = distance[tips]
+		matrix = tip_distance[:, None] + tip_distance[None, :] - 2 * shared
+		numpy.fill_diagonal(matrix, 0)
+		return self.get_labels(tips), matrix
+
+	def prune(self, tips: Iterable[int]) -> 'Tree':
+		"""
+			Returns the tree connecting only the selected tips. Nodes left with a single child are removed and their
+			branch length is added to the child.
+		"""
+		keep_count = numpy.zeros(len(self), dtype = numpy.int64)
+		keep_count[numpy.asarray(list(tips), dtype = numpy.int64)] = 1
+		for level in reversed(self.levels[1:]):
+			numpy.add.at(keep_count, self.parent[level], keep_count[level])
+		kept = keep_count > 0
+
+		children = numpy.bincount(self.parent[kept & (self.parent >= 0)], minlength = len(self))
+		unary = kept & (children == 1) & ~self.is_tip
+		retained = kept & ~unary
+
+		lengths = self.branch_length.copy()
+		new_parent = self.parent.copy()
+		for level in self.levels[1:]:
+			parents = new_parent[level]
+			collapse = parents >= 0
+			collapse[collapse] = unary[parents[collapse]]
+			nodes = level[collapse]
+			lengths[nodes] = lengths[nodes] + lengths[new_parent[nodes]]
+			new_parent[nodes] = new_parent[new_parent[nodes]]
+		# If the root was removed, the new root takes its branch length.
+		lengths[new_parent < 0] = self.branch_length[0]
+
+		index = numpy.full(len(self), -1, dtype = numpy.int64)
+		index[retained] = numpy.arange(retained.sum())
+		nodes = numpy.flatnonzero(retained)
+		parents = new_parent[nodes]
+		parents = numpy.where(parents >= 0, index[numpy.maximum(parents, 0)], -1)
+		return Tree(parents, lengths[nodes], self.support[nodes], self.label_index[nodes], self.labels)
+
+	def children(self) -> List[numpy.ndarray]:
+		""" The children of each node, in order."""
+		nodes = numpy.flatnonzero(self.parent >= 0)
+		order = numpy.argsort(self.parent[nodes], kind = 'stable')
+		counts = numpy.bincount(self.parent[nodes], minlength = len(self))
+		return numpy.split(nodes[order], numpy.cumsum(counts)[:-1])
+
+	def to_newick(self) -> str:
+		children = self.children()
+		output = list()
+
+		def annotation(node):
+			text = ''
+			if self.label_index[node] >= 0:
+				text += _quote(self.labels[self.label_index[node]])
+			elif not self.is_tip[node] and not numpy.isnan(self.support[node]):
+				text += '{:g}'.format(self.support[node])
+			if not numpy.isnan(self.branch_length[node]):
+				text += ':{:g}'.format(self.branch_length[node])
+			return text
+
+		# Iterative depth-first traversal: negative entries mark the end of a subtree.
+		stack = [0]
+		while stack:
+			node = stack.pop()
+			if node < 0:
+				output.append(')' + annotation(~node))
+				continue
+			if output and output[-1] != '(':
+				output.append(',')
+			if self.is_tip[node]:
+				output.append(annotation(node))
+			else:
+				output.append('(')
+				stack.append(~node)
+				stack.extend(reversed(children[node].tolist()))
+		return "".join(output) + ';'
+
+	def save(self, path: Path) -> Path:
+		with path.open('w') as file1:
+			file1.write(self.to_newick() + '\n')
+		return path
+
+
+def parse_newick(stream: Union[str, TextIO]) -> Tree:
+	""" Reads the first tree from a newick string or stream."""
+	if isinstance(stream, str):
+		stream = io.StringIO(stream)
+	parent = [-1]
+	branch_length = [numpy.nan]
+	support = [numpy.nan]
+	label_index = [-1]
+	labels: List[str] = list()
+	label_ids: Dict[str, int] = dict()
+
+	def set_label(node: int, token: str):
+		label = _unquote(token)
+		if label not in label_ids:
+			label_ids[label] = len(labels)
+			labels.append(label)
+		label_index[node] = label_ids[label]
+
+	stack = list()
+	current = 0
+	previous = ''
+	for token in _tokenize(stream):
+		if token.isspace() or token.startswith('['):
+			continue
+		if token == '(' or (token == ',' and stack):
+			if token == '(':
+				stack.append(current)
+			parent.append(stack[-1])
+			branch_length.append(numpy.nan)
+			support.append(numpy.nan)
+			label_index.append(-1)
+			current = len(parent) - 1
+		elif token == ')':
+			current = stack.pop()
+		elif token == ';':
+			break
+		elif token[0] not in NEWICK_DELIMITERS:
+			if previous == ':':
+				branch_length[current] = float(token)
+			elif previous == ')':
+				# Internal node labels are usually support values.
+				try:
+					support[current] = float(token)
+				except ValueError:
+					set_label(current, token)
+			else:
+				set_label(current, token)
+		previous = token
+
+	return Tree(
+		numpy.array(parent, dtype = numpy.int32),
+		numpy.array(branch_length, dtype = numpy.float64),
+		numpy.array(support, dtype = numpy.float32),
+		numpy.array(label_index, dtype = numpy.int32),
+		labels
+	)
+
+
+def read_newick(path: Path) -> Tree:
+	with path.open('r') as tree_file:
+		return parse_newick(tree_file)
@@ -1,41 +1,182 @@
-
 from pathlib import Path
-from typing import List
+from typing import List, Dict, Iterable, Iterator, TextIO, Union
+import argparse
+import re
 try:
-	from ..misc_parsers import NCBIReport
+	from ..misc_parsers import NCBIReport, AssemblyReportMetadata, load_reports
 except:
-	from misc_parsers import NCBIReport
+	from misc_parsers import NCBIReport, AssemblyReportMetadata, load_reports
+
+LabelMap = Dict[str, str]
+
+# Matches a single newick token: a quoted label, a comment, an unquoted label/number, or a single delimiter.
+# Unterminated quotes and comments only match at the end of the buffer so they can be completed by the next chunk.
+# A closing quote must not be followed by another quote, so an escaped '' split across chunks is never taken as the end
+# of the label.
+NEWICK_TOKEN = re.compile(r"'(?:[^']|'')*'(?!')|'(?:[^']|'')*$|\[[^\]]*\]|\[[^\]]*$|[^()\[\],:;'\s]+|[\s\S]")
+NEWICK_DELIMITERS = set('()[],:;')
+
+
+def _accession(label: str) -> str:
+	""" The assembly accession at the start of a label, ex. 'GCF_002223045.1' from 'GCF_002223045.1_ASM222304v1'."""
+	return "_".join(label.split('_', 2)[:2])
 
-def remap_tree_labels(tree_path:Path, reports:List[NCBIReport]):
-	reports = [(NCBIReport(i) if not isinstance(i, NCBIReport) else i) for i in reports]
-	id_map = list()
+
+def build_label_map(reports: Iterable[Union[Path, NCBIReport, AssemblyReportMetadata]]) -> LabelMap:
+	""" Maps '{accession}_{assembly_name}' to 'organism|strain' for each report."""
+	id_map = dict()
 	for report in reports:
-		name = report.metadata.organism_name
-		strain = report.metadata.infraspecific_name
+		if isinstance(report, Path):
+			report = NCBIReport(report)
+		metadata = report.metadata if isinstance(report, NCBIReport) else report
+		name = metadata.organism_name
+		strain = metadata.infraspecific_name
 
-		assembly_name = report.metadata.assembly_name
-		accession=report.metadata.refseq_assembly_accession
+		assembly_name = metadata.assembly_name
+		accession = metadata.refseq_assembly_accession
 
 		value = "{}|{}".format(name, strain).replace('(', '').replace(')', '')
 		key = "{}_{}".format(accession, assembly_name)
 
-		id_map.append((key, value))
+		id_map[key] = value
+	return id_map
 
-	with tree_path.open('r') as tree_file:
-		contents = tree_file.read()
-		for key, value in id_map:
-			print("Replacing '{}' with '{}'".format(key, value))
-			contents = contents.replace(key, value)
-	output_file = tree_path.with_suffix('.labeled.treefile')
-	with output_file.open('w') as output:
-		output.write(contents)
-	print("Wrote content to ", output_file)
 
+class _LabelLookup:
+	"""
+		Looks up tip labels in a label map. Labels that are not an exact key but start with a key followed by
+		'_' or '.' (ex. 'GCF_002223045.1_ASM222304v1_genomic') keep their suffix.
+	"""
 
+	def __init__(self, id_map: LabelMap):
+		self.id_map = id_map
+		self.prefixes: Dict[str, List[str]] = dict()
+		for key in id_map:
+			self.prefixes.setdefault(_accession(key), list()).append(key)
+		self.replaced = 0
 
+	def __call__(self, label: str) -> str:
+		value = self.id_map.get(label)
+		if value is None:
+			quoted = label.startswith("'")
+			unquoted = label[1:-1].replace("''", "'") if quoted else label
+			value = self.id_map.get(unquoted)
+			if value is None:
+				for key in self.prefixes.get(_accession(unquoted), []):
+					if unquoted.startswith(key) and unquoted[len(key)] in '_.':
+						value = self.id_map[key] + unquoted[len(key):]
+						break
+		if value is None:
+			return label
+		self.replaced += 1
+		return value
 
 
-import pandas
-if __name__ == "__main__":
-	pass
+def _tokenize(stream: TextIO, chunk_size: int = 1024 * 1024) -> Iterator[str]:
+	""" Yields the newick tokens of a stream, reading it in chunks."""
+	buffer = ''
+	while True:
+		chunk = stream.read(chunk_size)
+		buffer += chunk
+		end_of_file = not chunk
+		position = 0
+		for match in NEWICK_TOKEN.finditer(buffer):
+			if match.end() == len(buffer) and not end_of_file:
+				break
+			yield match.group()
+			position = match.end()
+		buffer = buffer[position:]
+		if end_of_file:
+			break
+
+
+def relabel_newick(stream: TextIO, output: TextIO, id_map: Union[LabelMap, _LabelLookup]) -> int:
+	"""
+		Copies a newick tree from `stream` to `output`, replacing every node label found in `id_map`. Labels are
+		matched as whole tokens, so a key is never replaced inside another label.
+
+		Returns
+		-------
+			The number of labels that were replaced.
+	"""
+	lookup = id_map if isinstance(id_map, _LabelLookup) else _LabelLookup(id_map)
+	start = lookup.replaced
+	previous = ''
+	for token in _tokenize(stream):
+		# Tokens after ':' are branch lengths.
+		if token[0] not in NEWICK_DELIMITERS and not token.isspace() and previous != ':':
+			token = lookup(token)
+		output.write(token)
+		if not token.isspace():
+			previous = token
+	return lookup.replaced - start
 
+
+def remap_tree_labels(tree_path: Path, reports: Union[LabelMap, List[NCBIReport]], output_file: Path = None) -> Path:
+	"""
+		Replaces the assembly accessions in a tree with the organism and strain names from the NCBI reports.
+	Parameters
+	----------
+	tree_path: Path
+		The tree file, in newick format.
+	reports: List[NCBIReport]
+		The reports (or report paths) to take labels from, or a label map generated by `build_label_map()`.
+	output_file: Path
+		Defaults to the tree path with a '.labeled.treefile' suffix.
+	"""
+	id_map = reports if isinstance(reports, dict) else build_label_map(reports)
+	if output_file is None:
+		output_file = tree_path.with_suffix('.labeled.treefile')
+	with tree_path.open('r') as tree_file, output_file.open('w') as output:
+		replaced = relabel_newick(tree_file, output, id_map)
+	print("Replaced {} labels. Wrote content to {}".format(replaced, output_file))
+	return output_file
+
+
+def remap_many_tree_labels(tree_paths: Iterable[Path], reports: Union[LabelMap, List[NCBIReport]]) -> List[Path]:
+	""" Relabels many tree files with a single label map. See `remap_tree_labels()`."""
+	id_map = reports if isinstance(reports, dict) else build_label_map(reports)
+	return [remap_tree_labels(tree_path, id_map) for tree_path in tree_paths]
+
+
+def main(argv: List[str] = None):
+	parser = argparse.ArgumentParser(description = "Replaces the assembly accessions in newick trees with organism and strain names.")
+	parser.add_argument('trees', nargs = '+', help = "The tree files to relabel.")
+	parser.add_argument(
+		'-r', '--reports',
+		action = "append",
+		default = list(),
+		help = "A folder to search for '*/*_assembly_report.txt' files. May be given more than once.",
+		dest = 'reports'
+	)
+	parser.add_argument(
+		'-c', '--catalog',
+		action = "store",
+		help = "Take the labels from a report catalog (see ncbi-catalog) instead of parsing the reports.",
+		dest = 'catalog'
+	)
+	parser.add_argument(
+		'-p', '--processes',
+		action = "store",
+		type = int,
+		help = "The number of worker processes used to parse the reports. Defaults to the number of cpus.",
+		dest = 'processes'
+	)
+	args = parser.parse_args(argv)
+
+	if args.catalog:
+		try:
+			from ..misc_parsers.ncbi_catalog import NCBIReportCatalog
+		except:
+			from misc_parsers.ncbi_catalog import NCBIReportCatalog
+		catalog = NCBIReportCatalog(Path(args.catalog))
+		reports = catalog.get_all()
+		catalog.close()
+	else:
+		paths = [path for folder in args.reports for path in Path(folder).glob("*/*_assembly_report.txt")]
+		reports = load_reports(paths, args.processes)
+	remap_many_tree_labels([Path(i) for i in args.trees], build_label_map(reports))
+
+
+if __name__ == "__main__":
+	main()
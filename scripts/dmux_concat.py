@@ -1,34 +1,112 @@
 from pathlib import Path
-import pandas
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 import shutil
 import argparse
+import csv
+import errno
+import hashlib
+import json
+import os
+import queue
+import re
+import sys
+import threading
+import time
+import zlib
 
-LOGFILE_PATH = Path.home() / "fastq_concat_log_file.log"
+# bcl2fastq output names: {sample}_S{number}_L{lane}_R{read}_001.fastq.gz
+FASTQ_NAME = re.compile(r"^(.+)_S[0-9]+_(?:L[0-9]{3}_)?[RI][0-9]_[0-9]{3}[.]fastq[.]gz$")
 
-parser = argparse.ArgumentParser(
-	description = "Combines fastq files based on the SampleSheet.csv file used during a sequencing run.")
 
-parser.add_argument(
-	'-i', '--sheet',
-	action = "store",
-	help = "The filename of the sample sheet file used during the sequencing run, or a folder containing sample configuration folders with sample sheets",
-	dest = "sheet"
-)
+class RunLog:
+	"""
+		A buffered JSON-lines log of the events of a run. Each event is one json object with a timestamp. Events that
+		have a message are also printed.
+	Parameters
+	----------
+	path: Path
+		The log file. If None, messages are only printed.
+	buffer_size: int
+		The number of bytes buffered before the log is written to disk.
+	flush_interval: float
+		The maximum number of seconds an event stays in the buffer. Events in `flush_events` are written immediately,
+		so that a run that crashes still leaves a record of what went wrong.
+	"""
+
+	flush_events = {'error', 'summary'}
+
+	def __init__(self, path: Optional[Path] = None, buffer_size: int = 1024 * 1024, flush_interval: float = 1.0):
+		self.path = path
+		self.lock = threading.Lock()
+		self.file = path.open('a', buffering = buffer_size) if path else None
+		self.flush_interval = flush_interval
+		self.last_flush = time.perf_counter()
+
+	def event(self, event: str, message: str = None, **fields):
+		if message:
+			print(message)
+		if self.file:
+			record = json.dumps({'time': time.time(), 'event': event, **fields}, default = str)
+			with self.lock:
+				self.file.write(record + "\n")
+				now = time.perf_counter()
+				if event in self.flush_events or now - self.last_flush >= self.flush_interval:
+					self.file.flush()
+					self.last_flush = now
+
+	def close(self):
+		if self.file:
+			with self.lock:
+				self.file.close()
+			self.file = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exception):
+		self.close()
+
+
+class Progress:
+	"""
+		Prints a summary of the number of groups done, the amount of data copied and the estimated time remaining.
+	Parameters
+	----------
+	groups: int
+		The number of groups that will be copied.
+	total_bytes: int
+		The number of bytes that will be copied.
+	interval: float
+		The minimum number of seconds between updates.
+	"""
+
+	def __init__(self, groups: int, total_bytes: int, interval: float = 1.0):
+		self.groups = groups
+		self.total_bytes = total_bytes
+		self.interval = interval
+		self.done = 0
+		self.copied = 0
+		self.start = time.perf_counter()
+		self.last_update = 0
+		self.lock = threading.Lock()
 
-parser.add_argument(
-	'-o', '--output',
-	action = "store",
-	help = "Name of the output folder. The concatenated fastq files will be saved to this folder.",
-	dest = 'output'
-)
+	def update(self, size: int):
+		with self.lock:
+			self.done += 1
+			self.copied += size
+			now = time.perf_counter()
+			if now - self.last_update < self.interval and self.done < self.groups:
+				return
+			self.last_update = now
+			elapsed = now - self.start
+			rate = self.copied / max(elapsed, 1E-9)
+			eta = (self.total_bytes - self.copied) / rate if rate else float('nan')
+			print("\t[{}/{}] {:.2f}/{:.2f} GB, {:.1f} MB/s, ETA {:.0f}s".format(
+				self.done, self.groups, self.copied / 1E9, self.total_bytes / 1E9, rate / 1E6, eta))
 
-args = parser.parse_args()
 
-def print_log(string):
-	path = LOGFILE_PATH
-	with path.open('a') as log_file:
-		log_file.write(string + "\n")
-	print(string)
 
 def search_for_sample_sheets(folder:Path):
 	pattern = "*/SampleSheet.csv"
@@ -45,63 +123,548 @@ def groupby(iterable, by):
 	return groups
 
 
-def concatenate_files(output_file, files):
-	with output_file.open('wb') as output:
-		for f in files:
-			with f.open('rb') as fd:
-				shutil.copyfileobj(fd, output, 1024 * 1024 * 10)
+class DmuxIndex:
+	"""
+		An index of every fastq.gz file in the dmux folder, built by walking the folder once.
+	Parameters
+	----------
+	folder: Path
+		The dmux folder. Fastq files are expected at `<folder>/*/*/*/*.fastq.gz`.
+	files: List[str]
+		The fastq files, relative to `folder`.
+	directories: Dict[str, float]
+		The mtime of every directory that was searched. Used to tell whether a saved index is out of date.
+	"""
+
+	depth = 3
+
+	def __init__(self, folder: Path, files: List[str], directories: Dict[str, float]):
+		self.folder = folder
+		self.files = files
+		self.directories = directories
+		self.samples: Dict[str, Dict[str, List[Path]]] = dict()
+		for path in sorted(folder / filename for filename in files):
+			match = FASTQ_NAME.match(path.name)
+			stem_parts = path.stem.split('_')
+			if not match and len(stem_parts) < 2:
+				# Not '{sample}_*.fastq.gz', so it cannot belong to any sample.
+				continue
+			key = stem_parts[-2]
+			if match:
+				sample_names = [match.group(1)]
+			else:
+				# Files not named by bcl2fastq are indexed under every prefix that ends at a '_', matching the
+				# glob '{sample}_*.fastq.gz'.
+				parts = path.name.split('_')
+				sample_names = ["_".join(parts[:index]) for index in range(1, len(parts))]
+			for sample_name in sample_names:
+				self.samples.setdefault(sample_name, dict()).setdefault(key, list()).append(path)
+
+	@classmethod
+	def build(cls, folder: Path) -> 'DmuxIndex':
+		files = list()
+		directories = dict()
+		level = [(folder, '')]
+		for depth in range(cls.depth + 1):
+			next_level = list()
+			for directory, relative in level:
+				directories[relative] = directory.stat().st_mtime
+				with os.scandir(str(directory)) as entries:
+					for entry in entries:
+						name = relative + '/' + entry.name if relative else entry.name
+						if depth < cls.depth:
+							if entry.is_dir():
+								next_level.append((Path(entry.path), name))
+						elif entry.name.endswith('.fastq.gz') and entry.is_file():
+							files.append(name)
+			level = next_level
+		return cls(folder, files, directories)
+
+	@classmethod
+	def load(cls, path: Path, folder: Path) -> Optional['DmuxIndex']:
+		""" Loads a saved index. Returns None if it does not exist or the dmux folder has changed since it was saved."""
+		if not path.exists():
+			return None
+		with path.open('r') as file1:
+			data = json.load(file1)
+		if data.get('folder') != str(folder):
+			return None
+		index = cls(folder, data['files'], data['directories'])
+		return index if index.is_current() else None
+
+	@classmethod
+	def open(cls, folder: Path, path: Path = None) -> 'DmuxIndex':
+		""" Loads the saved index at `path` if it is up to date, otherwise builds (and saves) a new one."""
+		index = cls.load(path, folder) if path else None
+		if index is None:
+			index = cls.build(folder)
+			if path:
+				index.save(path)
+		return index
 
+	def is_current(self) -> bool:
+		""" Checks whether any of the indexed directories were modified (ex. a new run was added)."""
+		for relative, mtime in self.directories.items():
+			directory = self.folder / relative
+			if not directory.exists() or directory.stat().st_mtime != mtime:
+				return False
+		return True
 
-def combine_files(sample_sheet_path: Path, output_folder: Path):
+	def save(self, path: Path) -> Path:
+		with path.open('w') as file1:
+			json.dump({'folder': str(self.folder), 'files': self.files, 'directories': self.directories}, file1)
+		return path
+
+	def get(self, sample_name: str) -> Dict[str, List[Path]]:
+		""" Maps each read key (ex. 'R1') to the sorted fastq files of a sample."""
+		return self.samples.get(sample_name, dict())
+
+
+# Errors raised by copy_file_range/sendfile when the filesystem or kernel does not support them.
+UNSUPPORTED_COPY_ERRORS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF}
+
+
+def _kernel_copy(source: int, destination: int, size: int) -> int:
+	"""
+		Copies `size` bytes between two file descriptors without passing through user space. Uses copy_file_range
+		and then sendfile if available. Returns the number of bytes copied, which is 0 if neither is supported.
 	"""
+	methods = list()
+	if hasattr(os, 'copy_file_range'):
+		methods.append(lambda count: os.copy_file_range(source, destination, count))
+	if hasattr(os, 'sendfile'):
+		methods.append(lambda count: os.sendfile(destination, source, None, count))
+
+	for method in methods:
+		copied = 0
+		try:
+			while copied < size:
+				sent = method(min(size - copied, 1024 * 1024 * 1024))
+				if sent == 0:
+					break
+				copied += sent
+		except OSError as exception:
+			if copied or exception.errno not in UNSUPPORTED_COPY_ERRORS:
+				raise
+			continue
+		return copied
+	return 0
 
+
+class ConcatManifest:
+	"""
+		Records the source files (with their sizes and mtimes) and the size of every completed output, so that
+		re-runs can skip outputs that are already complete.
 	Parameters
 	----------
 	path: Path
+		The manifest file.
+	"""
+
+	def __init__(self, path: Path):
+		self.path = path
+		self.lock = threading.Lock()
+		self.entries: Dict[str, Dict] = dict()
+		if path.exists():
+			with path.open('r') as file1:
+				self.entries = json.load(file1)
+
+	@staticmethod
+	def describe(files: List[Path]) -> List[List]:
+		description = list()
+		for f in files:
+			stat = f.stat()
+			description.append([str(f), stat.st_size, stat.st_mtime])
+		return description
+
+	def is_complete(self, output_file: Path, files: List[Path]) -> bool:
+		""" Checks whether `output_file` was completely written from the current versions of `files`."""
+		entry = self.entries.get(str(output_file))
+		if entry is None or not output_file.exists():
+			return False
+		return entry['size'] == output_file.stat().st_size and entry['sources'] == self.describe(files)
+
+	def record(self, result: 'ConcatResult', files: List[Path]):
+		with self.lock:
+			self.entries[str(result.output)] = {
+				'sources': self.describe(files),
+				'size':    result.bytes,
+				'reads':   result.reads,
+				'md5':     result.md5
+			}
+			self.save()
+
+	def get_result(self, output_file: Path) -> 'ConcatResult':
+		""" The result recorded for a completed output."""
+		entry = self.entries[str(output_file)]
+		return ConcatResult(output_file, entry['size'], 0, entry.get('reads'), entry.get('md5'), True if entry.get('md5') else None)
+
+	def save(self):
+		temporary = self.path.with_name(self.path.name + '.partial')
+		with temporary.open('w') as file1:
+			json.dump(self.entries, file1, indent = 4, sort_keys = True)
+		os.replace(str(temporary), str(self.path))
+
+
+@dataclass
+class ConcatResult:
+	output: Path
+	bytes: int
+	seconds: float
+	reads: Optional[int] = None
+	md5: Optional[str] = None
+	valid: Optional[bool] = None
+	error: Optional[str] = None
+
+	@property
+	def failed(self) -> bool:
+		return self.error is not None or self.valid is False
+
+
+class GzipVerifier(threading.Thread):
+	"""
+		Checks the gzip members of a stream and counts its fastq records in a worker thread, so that verification
+		does not slow down the copy. Chunks are passed in with `feed()`.
+	"""
+
+	def __init__(self):
+		super().__init__(daemon = True)
+		self.chunks = queue.Queue(maxsize = 16)
+		self.md5 = hashlib.md5()
+		self.lines = 0
+		self.valid = True
+
+	def feed(self, chunk: bytes):
+		self.chunks.put(chunk)
+
+	def finish(self) -> Tuple[int, str, bool]:
+		""" Waits for the remaining chunks. Returns the number of reads, the md5 of the compressed data and whether it is valid."""
+		self.chunks.put(None)
+		self.join()
+		return self.lines // 4, self.md5.hexdigest(), self.valid
+
+	def run(self):
+		decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+		started = False
+		for chunk in iter(self.chunks.get, None):
+			self.md5.update(chunk)
+			if not self.valid:
+				continue
+			try:
+				while chunk:
+					started = True
+					self.lines += decompressor.decompress(chunk).count(b'\n')
+					# Each source file is a separate gzip member.
+					chunk = decompressor.unused_data
+					if chunk or decompressor.eof:
+						decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+						started = False
+			except zlib.error:
+				self.valid = False
+		if started:
+			# The last member was not terminated.
+			self.valid = False
+
+
+def concatenate_files(output_file: Path, files: List[Path], verify: bool = False) -> ConcatResult:
+	"""
+		Concatenates `files` into `output_file`. The data is written to a temporary file which is renamed once complete,
+		so an interrupted run never leaves a truncated output.
+	Parameters
+	----------
+	output_file: Path
+	files: List[Path]
+	verify: bool
+		If True, the data is copied through user space so that each gzip member can be checked and the fastq records
+		counted while it is written.
+		If the data is invalid, the temporary file is removed and `output_file` is left untouched.
+	"""
+	start = time.perf_counter()
+	written = 0
+	temporary = output_file.with_name('.' + output_file.name + '.partial')
+	result = ConcatResult(output_file, 0, 0)
+	verifier = GzipVerifier() if verify else None
+	if verifier:
+		verifier.start()
+	try:
+		with temporary.open('wb') as output:
+			for f in files:
+				with f.open('rb') as fd:
+					size = os.fstat(fd.fileno()).st_size
+					if verifier:
+						for chunk in iter(lambda: fd.read(1024 * 1024 * 4), b''):
+							output.write(chunk)
+							verifier.feed(chunk)
+						written += size
+						continue
+					output.flush()
+					copied = _kernel_copy(fd.fileno(), output.fileno(), size)
+					if copied < size:
+						# Fall back to a user-space copy of whatever remains.
+						fd.seek(copied)
+						output.seek(written + copied)
+						shutil.copyfileobj(fd, output, 1024 * 1024 * 10)
+					written += size
+	except BaseException:
+		if temporary.exists():
+			temporary.unlink()
+		raise
+	finally:
+		# Always stop the verifier, otherwise its thread waits for more chunks forever.
+		if verifier:
+			result.reads, result.md5, result.valid = verifier.finish()
+	result.bytes = written
+	if result.valid is False:
+		# Never give invalid data the name of a finished output.
+		temporary.unlink()
+	else:
+		os.replace(str(temporary), str(output_file))
+	result.seconds = time.perf_counter() - start
+	return result
+
+
+def write_summary(results: List[ConcatResult], path: Path) -> Path:
+	""" Saves a table of the bytes, reads, checksum and elapsed time of each output."""
+	table = [
+		{
+			'output':  r.output.name,
+			'bytes':   r.bytes,
+			'reads':   r.reads,
+			'md5':     r.md5,
+			'valid':   r.valid,
+			'error':   r.error,
+			'seconds': round(r.seconds, 3)
+		}
+		for r in results
+	]
+	with path.open('w', newline = '') as summary_file:
+		writer = csv.DictWriter(summary_file, fieldnames = ['output', 'bytes', 'reads', 'md5', 'valid', 'error', 'seconds'], delimiter = '\t')
+		writer.writeheader()
+		writer.writerows(table)
+	return path
+
+
+def read_sample_names(sample_sheet_path: Path) -> List[str]:
+	""" Reads the Sample_Name column of the [Data] section of a sample sheet, which starts on the 10th line."""
+	with sample_sheet_path.open('r', newline = '') as sample_sheet:
+		lines = sample_sheet.readlines()[9:]
+	rows = csv.DictReader(lines)
+	return [row['Sample_Name'] for row in rows if row.get('Sample_Name')]
+
+
+def plan_groups(sample_sheet_path: Path, output_folder: Path, index: DmuxIndex) -> List[Tuple[Path, List[Path]]]:
+	"""
+		Lists the output file and source files of every sample and read in a sample sheet.
+	Parameters
+	----------
+	sample_sheet_path: Path
 		path to a sample sheet.
+	output_folder: Path
+	index: DmuxIndex
+		The index of the dmux folder.
 
 	Returns
 	-------
+		A list of (output_filename, source_files) pairs.
+	"""
+	groups = list()
+	for sample_name in read_sample_names(sample_sheet_path):
+		# Sample_ID	Sample_Name	Species	Project	NucleicAcid	Sample_Well	I7_Index_ID	index	I5_Index_ID	index2
+		for key, values in sorted(index.get(sample_name).items()):
+			output_filename = output_folder / sample_sheet_path.parent.stem / "{}_{}.fastq.gz".format(sample_name, key)
+			groups.append((output_filename, values))
+	return groups
+
 
+def concatenate_groups(groups: List[Tuple[Path, List[Path]]], jobs: int = 4, manifest: ConcatManifest = None,
+		verify: bool = False, log: RunLog = None, dry_run: bool = False) -> List[ConcatResult]:
 	"""
+		Concatenates independent output groups concurrently.
+	Parameters
+	----------
+	groups: List[Tuple[Path, List[Path]]]
+		The (output_filename, source_files) pairs generated by `plan_groups()`.
+	jobs: int
+		The number of groups copied at once.
+	manifest: ConcatManifest
+		If given, outputs that the manifest lists as complete are skipped and new outputs are recorded.
+	verify: bool
+		Whether to check the gzip data and count reads while copying. See `concatenate_files()`.
+	log: RunLog
+		Where to record the events of the run.
+	dry_run: bool
+		If True, only reports the groups that would be copied and their total size.
 
-	dmux_folder = Path("/home/dmux")
-	sample_sheet = pandas.read_csv(str(sample_sheet_path), skiprows = 9)
+	Returns
+	-------
+		The result of every output, including skipped and failed outputs. Empty for a dry run.
+	"""
+	if log is None:
+		log = RunLog()
+	complete = list()
+	if manifest is not None:
+		complete = [group for group in groups if manifest.is_complete(*group)]
+		for output_filename, _ in complete:
+			log.event('skipped', output = output_filename)
+		if complete:
+			print("\tSkipping {} outputs that are already complete.".format(len(complete)))
+		groups = [group for group in groups if group not in complete]
 
-	for index, row in sample_sheet.iterrows():
-		# Sample_ID	Sample_Name	Species	Project	NucleicAcid	Sample_Well	I7_Index_ID	index	I5_Index_ID	index2
-		sample_name = row['Sample_Name']
-		candidates = dmux_folder.glob("*/*/*/{}_*.fastq.gz".format(sample_name))
-		candidates = sorted(candidates)
-		groups = groupby(candidates, lambda s: s.stem.split('_')[-2])
-		print(sample_sheet_path.parent.stem, sample_name)
+	sizes = [sum(f.stat().st_size for f in values) for _, values in groups]
+	for (output_filename, values), size in zip(groups, sizes):
+		log.event('planned', output = output_filename, sources = values, bytes = size)
+	total_bytes = sum(sizes)
+	log.event('plan', "\tPlanned {} outputs ({:.2f} GB)".format(len(groups), total_bytes / 1E9),
+		groups = len(groups), bytes = total_bytes, skipped = len(complete))
+	if dry_run:
+		return list()
 
-		for key, values in sorted(groups.items()):
-			output_filename = output_folder / sample_sheet_path.parent.stem/ "{}_{}.fastq.gz".format(sample_name, key)
-			if not output_filename.parent.exists():
-				output_filename.parent.mkdir()
+	for output_filename, _ in groups:
+		output_filename.parent.mkdir(parents = True, exist_ok = True)
+	progress = Progress(len(groups), total_bytes)
 
-			values = sorted(values)
-			print("\tCombining '{}-{}' ".format(sample_name, key))
-			for v in values:
-				print("\t\t", v)
-			print("\tOutput File: ", output_filename)
+	def run(group) -> ConcatResult:
+		output_filename, values = group
+		log.event('start', output = output_filename, sources = len(values))
+		try:
+			result = concatenate_files(output_filename, values, verify)
+		except OSError as exception:
+			log.event('error', "\tCould not write '{}': {}".format(output_filename, exception),
+				output = output_filename, error = repr(exception))
+			return ConcatResult(output_filename, 0, 0, error = str(exception))
+		log.event('end', output = output_filename, bytes = result.bytes, seconds = result.seconds,
+			throughput = result.bytes / max(result.seconds, 1E-9), reads = result.reads, md5 = result.md5, valid = result.valid)
+		if result.valid is False:
+			log.event('error', "\tInvalid gzip data in '{}'".format(output_filename), output = output_filename,
+				error = 'invalid gzip data')
+		elif manifest is not None:
+			manifest.record(result, values)
+		progress.update(result.bytes)
+		return result
 
-			concatenate_files(output_filename, values)
+	start = time.perf_counter()
+	with ThreadPoolExecutor(max_workers = jobs) as executor:
+		results = list(executor.map(run, groups))
+	elapsed = time.perf_counter() - start
+	written = [i for i in results if not i.failed]
+	errors = len(results) - len(written)
+	total = sum(i.bytes for i in written)
+	log.event('summary', "Wrote {} files ({:.2f} GB) in {:.1f}s ({:.1f} MB/s)".format(
+		len(written), total / 1E9, elapsed, total / 1E6 / max(elapsed, 1E-9)),
+		files = len(written), bytes = total, seconds = elapsed, errors = errors)
+	if errors:
+		print("{} outputs could not be written or failed verification.".format(errors))
+	return [manifest.get_result(output_filename) for output_filename, _ in complete] + results
 
 
-if __name__ == "__main__":
-	data_folder = Path("/home/data")
-	dmux_folder = Path("/home/dmux")
+def combine_files(sample_sheet_path: Path, output_folder: Path, index: DmuxIndex = None, jobs: int = 4,
+		verify: bool = False, log: RunLog = None, dry_run: bool = False) -> List[ConcatResult]:
+	"""
+
+	Parameters
+	----------
+	path: Path
+		path to a sample sheet.
+	index: DmuxIndex
+		The index of the dmux folder. Built from '/home/dmux' if not provided.
+	jobs: int
+		The number of output files written at once.
+	verify: bool
+		Whether to check the gzip data and count reads while copying.
+	log: RunLog
+		Where to record the events of the run.
+	dry_run: bool
+		If True, only reports what would be copied.
+
+	Returns
+	-------
+		The result of every output. A summary table is saved alongside the outputs.
+	"""
+	if index is None:
+		index = DmuxIndex.build(Path("/home/dmux"))
+	if log is None:
+		log = RunLog()
+	log.event('sample_sheet', sample_sheet_path.parent.stem, path = sample_sheet_path)
+	groups = plan_groups(sample_sheet_path, output_folder, index)
+	manifest = ConcatManifest(output_folder / "concat_manifest.json")
+	results = concatenate_groups(groups, jobs, manifest, verify, log, dry_run)
+	if results:
+		write_summary(results, output_folder / sample_sheet_path.parent.stem / "concat_summary.tsv")
+	return results
+
+
+def main(argv: List[str] = None):
+	parser = argparse.ArgumentParser(
+		description = "Combines fastq files based on the SampleSheet.csv file used during a sequencing run.")
+
+	parser.add_argument(
+		'-i', '--sheet',
+		action = "store",
+		required = True,
+		help = "The filename of the sample sheet file used during the sequencing run, or a folder containing sample configuration folders with sample sheets",
+		dest = "sheet"
+	)
+
+	parser.add_argument(
+		'-o', '--output',
+		action = "store",
+		help = "Name of the output folder. The concatenated fastq files will be saved to this folder.",
+		dest = 'output'
+	)
+
+	parser.add_argument(
+		'-d', '--dmux',
+		action = "store",
+		help = "The folder containing the demultiplexed fastq files. Defaults to '/home/dmux'",
+		default = "/home/dmux",
+		dest = 'dmux'
+	)
+
+	parser.add_argument(
+		'--index',
+		action = "store",
+		help = "A file to save the index of the dmux folder to. The index is reused by later runs until the dmux folder changes.",
+		dest = 'index'
+	)
+
+	parser.add_argument(
+		'-j', '--jobs',
+		action = "store",
+		type = int,
+		help = "The number of output files to write at once. Defaults to 4.",
+		default = 4,
+		dest = 'jobs'
+	)
+
+	parser.add_argument(
+		'--verify',
+		action = "store_true",
+		help = "Check the gzip data and count the reads of each output while it is written.",
+		dest = 'verify'
+	)
+
+	parser.add_argument(
+		'-n', '--dry-run',
+		action = "store_true",
+		help = "Only report the outputs that would be written and their total size.",
+		dest = 'dry_run'
+	)
+
+	parser.add_argument(
+		'-r', '--run',
+		action = "append",
+		help = "Only use the sample sheets of runs whose folder name starts with this prefix (ex. '180416'). May be given more than once.",
+		dest = 'runs'
+	)
+
+	args = parser.parse_args(argv)
+
+	dmux_folder = Path(args.dmux)
 	if args.output:
 		output_folder = Path(args.output)
 	else:
 		output_folder = Path.home() / "concatenated_fastq_files"
-	LOGFILE_PATH = output_folder / "fastq_concat_log_file.txt"
-	if args.sheet:
-		sample_sheet = Path(args.sheet)
-	else:
-		sample_sheet = data_folder / "180416_NB501145_0100_AHJNJ5BGX5" / "SampleSheet.csv"
+	sample_sheet = Path(args.sheet)
 
 	if not output_folder.exists():
 		output_folder.mkdir()
@@ -109,7 +672,18 @@ if __name__ == "__main__":
 		sample_sheets = search_for_sample_sheets(sample_sheet)
 	else:
 		sample_sheets = [sample_sheet]
-	for sample_sheet in sample_sheets:
-		print("Using {}...".format(sample_sheet))
-		if sample_sheet.parent.stem.split('_')[0] not in ['180416', '180423']: continue
-		combine_files(sample_sheet, output_folder)
+	index = DmuxIndex.open(dmux_folder, Path(args.index) if args.index else None)
+	failed = 0
+	with RunLog(output_folder / "fastq_concat_log.jsonl") as log:
+		for sample_sheet in sample_sheets:
+			if args.runs and not any(sample_sheet.parent.stem.startswith(i) for i in args.runs): continue
+			print("Using {}...".format(sample_sheet))
+			results = combine_files(sample_sheet, output_folder, index, args.jobs, args.verify, log, args.dry_run)
+			failed += sum(1 for i in results if i.failed)
+	if failed:
+		# A non-zero exit status lets scheduled runs detect a bad concatenation.
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,22 @@
+import io
+
+from phylogeny.tree_labels import _tokenize
+
+TREES = [
+	"(('GCF_1.1_ASM1''x':0.1,B:0.2)C,'D''''':1);",
+	"('a b':1,[comment]'':2)'root''s label';",
+	"((A:0.1,B:0.2)90:0.3,[an, unterminated comment",
+	"(A,'unterminated ''label"
+]
+
+
+def test_tokenize_is_independent_of_the_chunk_size():
+	for tree in TREES:
+		expected = list(_tokenize(io.StringIO(tree)))
+		for chunk_size in range(1, len(tree) + 2):
+			assert list(_tokenize(io.StringIO(tree), chunk_size)) == expected, (tree, chunk_size)
+
+
+def test_tokenize_keeps_escaped_quotes_in_the_label():
+	tokens = list(_tokenize(io.StringIO("(('GCF_1.1_ASM1''x':0.1,B:0.2));"), 3))
+	assert "'GCF_1.1_ASM1''x'" in tokens